@@ -8,21 +8,89 @@ from kivy.uix.button import Button
 from kivy.uix.textinput import TextInput
 from kivy.uix.spinner import Spinner
 from kivy.uix.popup import Popup
-from kivy.graphics import Color, Rectangle, RoundedRectangle
+from kivy.uix.widget import Widget
+from kivy.graphics import (Color, Ellipse, InstructionGroup, Line, PopMatrix, PushMatrix,
+                           Rectangle, RoundedRectangle, Translate)
+from kivy.core.text import Label as CoreLabel
 from kivy.core.window import Window
-from datetime import datetime, timedelta
+from kivy.clock import Clock
+from datetime import date, datetime, timedelta
+from bisect import bisect_left, bisect_right, insort
+import copy
 import json
 import hashlib
 import os
-from collections import defaultdict
+import re
+import math
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from sync import RECORD_COLLECTIONS, ChangeLog, SyncClient, SyncError, merge_versions
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
 
 Window.clearcolor = (0.95, 0.95, 0.97, 1)
 
+SHARDED_COLLECTIONS = ('expenses', 'income')
+GROUP_FIELDS = {'expenses': 'category', 'income': 'source'}
+EXPENSE_CATEGORIES = ['Food', 'Transport', 'Shopping', 'Bills', 'Entertainment', 'Health', 'Education', 'Other']
+INCOME_SOURCES = ['Salary', 'Freelance', 'Investment', 'Gift', 'Loan Returned', 'Business', 'Other']
+PAYMENT_METHODS = ['Cash', 'Card', 'UPI', 'Bank Transfer']
+DEFAULT_CURRENCY = 'INR'
+CURRENCY_SYMBOLS = {'INR': 'Rs.', 'USD': '$', 'EUR': '€', 'GBP': '£'}
+
+def money(amount, currency=DEFAULT_CURRENCY):
+    return f'{CURRENCY_SYMBOLS.get(currency, currency)} {amount:,.2f}'
+
+def base_currency(data):
+    return data.get('settings', {}).get('base_currency', DEFAULT_CURRENCY)
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def write_json(path, obj):
+    # Readers in other processes only ever see a complete old or new file
+    with open(path + '.tmp', 'w') as f:
+        json.dump(obj, f, indent=4)
+    os.replace(path + '.tmp', path)
+
 # Secure data storage with encryption
 class SecureStorage:
+    MAX_ARCHIVED_SHARDS = 3
+    
     def __init__(self, filename='main_data.json'):
         self.filename = filename
         self.password_hash = None
+        self.fx = FxRates()
+        self.budget_tracker = BudgetTracker(self.fx)
+        self.insights = SpendingInsights(self)
+        self.suggester = ExpenseSuggester(self)
+        self.daily = DailyIndex(self)
+        self.changes = ChangeLog(self)
+        self.history = CommandHistory(self)
+        self.loan_book = LoanBook([])
+        self.sync_client = None
+        self.data = None
+        self.current_year = None
+        self.shards = OrderedDict()
+        self.dirty = set()
+        self.touched = OrderedDict()
+        self.stamps = {}
+        self.revision = 0
+        self.lock_stamp = None
+        self.rebased = False
+        self.version = 0
+        self.cache = {}
         self.load_password()
     
     def load_password(self):
@@ -38,15 +106,1233 @@ class SecureStorage:
     def verify_password(self, password):
         return hashlib.sha256(password.encode()).hexdigest() == self.password_hash
     
+    def shard_filename(self, year):
+        root, ext = os.path.splitext(self.filename)
+        return f'{root}_{year}{ext}'
+    
+    def lock_filename(self):
+        return self.filename + '.lock'
+    
+    @contextmanager
+    def locked(self):
+        # Advisory lock shared by every process using this data file; it also stores the commit revision
+        with open(self.lock_filename(), 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                f.seek(0)
+                yield f
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                elif msvcrt is not None:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    
+    @staticmethod
+    def read_revision(lock):
+        lock.seek(0)
+        text = lock.read().strip()
+        return int(text) if text.isdigit() else 0
+    
+    def read_json(self, path):
+        # Stamp first: a file replaced mid-read then just looks changed at the next poll
+        self.stamps[path] = file_stamp(path)
+        with open(path, 'r') as f:
+            return json.load(f)
+    
     def save_data(self, data):
-        with open(self.filename, 'w') as f:
-            json.dump(data, f, indent=4)
+        with self.locked() as lock:
+            return self.commit(data, lock)
+    
+    @contextmanager
+    def transaction(self, save=True):
+        # A short critical section: catch up with other processes' commits, then commit on the way out
+        data = self.load_data()
+        with self.locked() as lock:
+            revision = self.read_revision(lock)
+            if revision != self.revision:
+                self.reload(data, revision)
+            yield data
+            if save:
+                self.commit(data, lock)
+    
+    def commit(self, data, lock):
+        # Optimistic check: if another process committed since we last read, rebase our edits onto its files
+        revision = self.read_revision(lock)
+        rebased = revision != self.revision
+        if rebased:
+            self.reload(data, revision)
+        for year in sorted(self.dirty):
+            self.write_shard(year)
+        write_json(self.filename, {k: v for k, v in data.items() if k not in SHARDED_COLLECTIONS})
+        self.stamps[self.filename] = file_stamp(self.filename)
+        
+        self.revision += 1
+        lock.seek(0)
+        lock.truncate()
+        lock.write(str(self.revision))
+        lock.flush()
+        self.lock_stamp = file_stamp(self.lock_filename())
+        self.touched.clear()
+        return rebased
+    
+    def write_shard(self, year):
+        write_json(self.shard_filename(year), self.shards[year])
+        self.stamps[self.shard_filename(year)] = file_stamp(self.shard_filename(year))
+        if year in self.daily.years:
+            self.daily.years[year]['stamp'] = self.stamps[self.shard_filename(year)]
+        self.dirty.discard(year)
+    
+    def touch(self, collection, key, record=None):
+        self.touched[(collection, key)] = record
+    
+    def reload(self, data, revision):
+        # Re-read the main file and only the cached shards that changed on disk or hold unsaved edits,
+        # then reapply the records, budgets and settings changed here since the last commit
+        unsaved = []
+        for (collection, key), record in self.touched.items():
+            if collection == 'budgets':
+                unsaved.append((collection, key, data['budgets'].get(key, 0)))
+            elif collection == 'settings':
+                unsaved.append((collection, key, data['settings'][key]))
+            else:
+                unsaved.append((collection, key, copy.deepcopy(record)))
+        
+        fresh = self.read_json(self.filename) if os.path.exists(self.filename) else {}
+        for year in list(self.shards):
+            path = self.shard_filename(year)
+            if year in self.dirty or file_stamp(path) != self.stamps.get(path):
+                del self.shards[year]
+                self.daily.years.pop(year, None)
+        for year, index in list(self.daily.years.items()):
+            if file_stamp(self.shard_filename(year)) != index['stamp']:
+                del self.daily.years[year]
+        self.dirty.clear()
+        self.touched.clear()
+        data.clear()
+        data.update(fresh)
+        self.loan_book = LoanBook(data.get('loans', []))
+        current = self.shard(self.current_year)
+        for collection in SHARDED_COLLECTIONS:
+            data[collection] = current[collection]
+        self.revision = revision
+        self.version += 1
+        self.rebased = True
+        
+        for collection, key, value in unsaved:
+            if collection == 'settings':
+                self.set_setting(data, key, value)
+            elif collection == 'budgets':
+                self.set_budget(data, key, value)
+            else:
+                stored = self.apply_changes(data, [{'collection': collection, 'uid': key, 'record': value, 'known': True}])
+                self.changes.record_change(data, collection, stored[0])
+    
+    def poll(self):
+        # One stat per call; files are only read once another process has committed
+        changed = self.fx.refresh()
+        if self.data is not None and file_stamp(self.lock_filename()) != self.lock_stamp:
+            with self.locked() as lock:
+                revision = self.read_revision(lock)
+                if revision != self.revision:
+                    self.reload(self.data, revision)
+                self.lock_stamp = file_stamp(self.lock_filename())
+        # A save that had to rebase onto another commit also leaves open screens showing stale objects
+        changed, self.rebased = changed or self.rebased, False
+        return changed
     
     def load_data(self):
-        if os.path.exists(self.filename):
+        if self.data is None:
+            data = {'expenses': [], 'income': [], 'loans': []}
+            with self.locked() as lock:
+                self.revision = self.read_revision(lock)
+                self.lock_stamp = file_stamp(self.lock_filename())
+                if os.path.exists(self.filename):
+                    data = self.read_json(self.filename)
+            self.data = data
+            if 'shards' not in data:
+                self.migrate(data)
+                self.save_data(data)
+            self.loan_book = LoanBook(data['loans'])
+        
+        year = datetime.now().strftime('%Y')
+        if year != self.current_year:
+            self.current_year = year
+            current = self.shard(year)
+            for collection in SHARDED_COLLECTIONS:
+                self.data[collection] = current[collection]
+            self.evict()
+        return self.data
+    
+    def migrate(self, data):
+        # Convert the original single-file format straight to the current one: every index is built
+        # from the full history, then it is split into yearly shards plus a manifest of per-shard totals
+        for collection in RECORD_COLLECTIONS:
+            data.setdefault(collection, [])
+            for record in data[collection]:
+                record.setdefault('uid', ChangeLog.legacy_uid(collection, record))
+        self.budget_tracker.ensure(data)
+        self.insights.rebuild(data)
+        self.suggester.rebuild(data)
+        data['next_id'] = {c: max((r['id'] for r in data[c]), default=0) for c in RECORD_COLLECTIONS}
+        data['shards'] = {}
+        for collection in SHARDED_COLLECTIONS:
+            for record in data.pop(collection):
+                self.store_record(data, collection, record)
+                self.count_record(data, collection, record, 1)
+    
+    def shard(self, year):
+        if year in self.shards:
+            self.shards.move_to_end(year)
+            return self.shards[year]
+        
+        shard = {collection: [] for collection in SHARDED_COLLECTIONS}
+        if os.path.exists(self.shard_filename(year)):
+            shard = self.read_json(self.shard_filename(year))
+        self.shards[year] = shard
+        self.evict()
+        return shard
+    
+    def evict(self):
+        archived = [y for y in self.shards if y != self.current_year and y not in self.dirty]
+        while len(archived) > self.MAX_ARCHIVED_SHARDS:
+            del self.shards[archived.pop(0)]
+    
+    def records(self, data, collection, start_year=None, end_year=None):
+        # Tombstoned (deleted) records stay in place for sync and undo but are never yielded;
+        # until migrate() has sharded the data every record is still in the main file
+        if collection not in SHARDED_COLLECTIONS or 'shards' not in data:
+            yield from (r for r in data[collection] if not r.get('deleted'))
+            return
+        for year in sorted(set(data['shards']) | {self.current_year}):
+            if (start_year and year < start_year) or (end_year and year > end_year):
+                continue
+            yield from (r for r in self.shard(year)[collection] if not r.get('deleted'))
+    
+    def find_record(self, data, collection, uid, day):
+        records = self.shard(day[:4])[collection] if collection in SHARDED_COLLECTIONS else data[collection]
+        return next((r for r in records if r.get('uid') == uid), None)
+    
+    def records_by_uid(self, data, collection, day):
+        # Only the shard holding the day's year is loaded
+        records = self.shard(day[:4])[collection] if collection in SHARDED_COLLECTIONS else data[collection]
+        return {r['uid']: r for r in records}
+    
+    def pending(self, data, collection, day):
+        # Uids waiting to be synced sit beside their records, so the main file never grows with history
+        if collection not in SHARDED_COLLECTIONS:
+            return data['sync']['pending']
+        return self.shard(day[:4]).setdefault('pending', {})
+    
+    def mark_pending(self, data, collection, uid, day, pending):
+        uids = self.pending(data, collection, day)
+        uids.pop(uid, None)
+        if pending:
+            uids[uid] = collection
+        if collection in SHARDED_COLLECTIONS:
+            year, years = day[:4], data['sync']['years']
+            self.dirty.add(year)
+            if uids and year not in years:
+                insort(years, year)
+            elif not uids and year in years:
+                years.remove(year)
+    
+    def pending_records(self, data, limit):
+        # Loans and budgets first, then the yearly shards listed as holding unsynced changes
+        found = []
+        loans = None
+        for uid, collection in data['sync']['pending'].items():
+            if collection == 'loans':
+                loans = loans or self.records_by_uid(data, 'loans', None)
+            found.append((collection, uid, loans.get(uid) if collection == 'loans' else None))
+        for year in data['sync']['years']:
+            if len(found) >= limit:
+                break
+            shard = self.shard(year)
+            by_uid = {r['uid']: r for collection in SHARDED_COLLECTIONS for r in shard[collection]}
+            found.extend((collection, uid, by_uid.get(uid)) for uid, collection in shard['pending'].items())
+        return [change for change in found if change[0] == 'budgets' or change[2] is not None][:limit]
+    
+    def cached(self, key, compute):
+        # Converted aggregates stay valid until a record or an exchange rate changes
+        versions = (self.version, self.fx.version)
+        hit = self.cache.get(key)
+        if hit is None or hit[0] != versions:
+            hit = self.cache[key] = (versions, compute())
+        return hit[1]
+    
+    def total(self, data, collection):
+        def compute():
+            amounts = {}
+            for shard in data['shards'].values():
+                for currency, by_month in shard.get(collection, {}).get('amounts', {}).items():
+                    amounts.setdefault(currency, {}).update(by_month)
+            return self.fx.convert(amounts, base)
+        base = base_currency(data)
+        return self.cached(('total', collection, base), compute)
+    
+    def loans_outstanding(self, data, loans, loan_type):
+        today = datetime.now().strftime('%Y-%m-%d')
+        amounts = {}
+        for loan in loans:
+            if loan['type'] == loan_type:
+                currency = loan.get('currency', DEFAULT_CURRENCY)
+                amounts[currency] = {today: amounts.get(currency, {}).get(today, 0) + LoanBook.outstanding(loan)}
+        return self.fx.convert(amounts, base_currency(data))
+    
+    def count_record(self, data, collection, record, sign):
+        if collection not in SHARDED_COLLECTIONS:
+            return
+        totals = data['shards'].setdefault(record['date'][:4], {})
+        totals = totals.setdefault(collection, {'count': 0, 'amounts': {}})
+        totals['count'] += sign
+        by_month = totals['amounts'].setdefault(record.get('currency', DEFAULT_CURRENCY), {})
+        month = record['date'][:7]
+        by_month[month] = by_month.get(month, 0) + sign * record['amount']
+    
+    def store_record(self, data, collection, record):
+        if collection in SHARDED_COLLECTIONS:
+            year = record['date'][:4]
+            self.shard(year)[collection].append(record)
+            self.dirty.add(year)
+        else:
+            data[collection].append(record)
+    
+    def add_record(self, data, collection, record):
+        data['next_id'][collection] += 1
+        record['id'] = data['next_id'][collection]
+        record.setdefault('uid', ChangeLog.new_uid())
+        self.store_record(data, collection, record)
+        self.index_record(data, collection, record)
+        self.changes.record_change(data, collection, record)
+        self.touch(collection, record['uid'], record)
+        return record
+    
+    def index_record(self, data, collection, record):
+        self.version += 1
+        if record.get('deleted'):
+            return
+        self.count_record(data, collection, record, 1)
+        self.daily.update(data, collection, record, 1)
+        if collection == 'expenses':
+            self.budget_tracker.record_expense(data, record)
+            self.insights.update(data, record, 1)
+            self.suggester.update(data, record, 1)
+        elif collection == 'loans':
+            self.loan_book.track(record)
+    
+    def unindex_record(self, data, collection, record):
+        self.version += 1
+        if record.get('deleted'):
+            return
+        self.count_record(data, collection, record, -1)
+        self.daily.update(data, collection, record, -1)
+        if collection == 'expenses':
+            self.budget_tracker.remove_expense(data, record)
+            self.insights.update(data, record, -1)
+            self.suggester.update(data, record, -1)
+        elif collection == 'loans':
+            self.loan_book.untrack(record)
+    
+    def update_record(self, data, collection, record, mutate):
+        # Deleting sets a tombstone, so edits and deletes both adjust every index incrementally
+        self.unindex_record(data, collection, record)
+        mutate(record)
+        self.index_record(data, collection, record)
+        if collection in SHARDED_COLLECTIONS:
+            self.dirty.add(record['date'][:4])
+        self.changes.record_change(data, collection, record)
+        self.touch(collection, record['uid'], record)
+        return record
+    
+    def set_budget(self, data, category, amount):
+        alert = self.budget_tracker.set_budget(data, category, amount)
+        self.changes.record_change(data, 'budgets', {'category': category, 'amount': amount})
+        self.touch('budgets', category)
+        return alert
+    
+    def set_setting(self, data, key, value):
+        data.setdefault('settings', {})[key] = value
+        self.touch('settings', key)
+    
+    def apply_changes(self, data, changes):
+        by_uid = {}
+        stored = []
+        for change in changes:
+            collection, record = change['collection'], dict(change['record'])
+            if collection == 'budgets':
+                self.budget_tracker.set_budget(data, record['category'], record['amount'])
+                self.touch('budgets', record['category'])
+                continue
+            
+            year = record['date'][:4] if collection in SHARDED_COLLECTIONS else collection
+            if change['known'] and year not in by_uid:
+                by_uid[year] = self.records_by_uid(data, collection, record['date'])
+            existing = by_uid.get(year, {}).get(change['uid'])
+            
+            if existing is None:
+                data['next_id'][collection] += 1
+                record['id'] = data['next_id'][collection]
+                self.store_record(data, collection, record)
+                self.index_record(data, collection, record)
+                self.touch(collection, change['uid'], record)
+                stored.append(record)
+            else:
+                self.unindex_record(data, collection, existing)
+                record['id'] = existing['id']
+                # A replayed local edit must not drop versions the reloaded copy learned from other devices
+                record['vv'] = merge_versions(existing.get('vv', {}), record.get('vv', {}))
+                existing.clear()
+                existing.update(record)
+                self.index_record(data, collection, existing)
+                self.touch(collection, change['uid'], existing)
+                stored.append(existing)
+                if collection in SHARDED_COLLECTIONS:
+                    self.dirty.add(year)
+        return stored
+    
+    def sync(self, url):
+        if self.sync_client is None or self.sync_client.url != url:
+            if self.sync_client is not None:
+                self.sync_client.close()
+            self.sync_client = SyncClient(url)
+        if self.load_data().get('sync', {}).get('server_url') != url:
+            with self.transaction() as data:
+                self.changes.ensure(data, ((c, r) for c in RECORD_COLLECTIONS for r in self.records(data, c)))
+                data['sync']['server_url'] = url
+        # The lock is taken per batch, never across the HTTP exchange, so other processes and poll() keep going
+        return self.sync_client.sync(self.transaction, self.changes, self.apply_changes)
+
+# Bounded undo/redo history of per-record field diffs (never full data copies)
+class CommandHistory:
+    MISSING = object()
+    
+    def __init__(self, storage, limit=50):
+        self.storage = storage
+        self.undo_stack = deque(maxlen=limit)
+        self.redo_stack = []
+    
+    def push(self, command):
+        self.undo_stack.append(command)
+        del self.redo_stack[:]
+    
+    def add(self, data, collection, record, label):
+        self.storage.add_record(data, collection, record)
+        # Undoing an add tombstones the record; redoing it lifts the tombstone
+        self.push({'label': label, 'collection': collection, 'uid': record['uid'], 'date': record['date'],
+                   'before': {'deleted': True}, 'after': {'deleted': self.MISSING}})
+        return record
+    
+    def edit(self, data, collection, record, mutate, label):
+        before = copy.deepcopy(record)
+        self.storage.update_record(data, collection, record, mutate)
+        changed = [k for k in set(before) | set(record) if before.get(k, self.MISSING) != record.get(k, self.MISSING)]
+        if changed:
+            self.push({'label': label, 'collection': collection, 'uid': record['uid'], 'date': record['date'],
+                       'before': {k: before.get(k, self.MISSING) for k in changed},
+                       'after': {k: copy.deepcopy(record[k]) if k in record else self.MISSING for k in changed}})
+        return record
+    
+    def delete(self, data, collection, record, label):
+        return self.edit(data, collection, record, lambda r: r.update(deleted=True), label)
+    
+    def set_budget(self, data, category, amount, label):
+        self.storage.budget_tracker.ensure(data)
+        before = data['budgets'].get(category, 0)
+        alert = self.storage.set_budget(data, category, amount)
+        self.push({'label': label, 'collection': 'budgets', 'category': category,
+                   'before': before, 'after': amount})
+        return alert
+    
+    def restore(self, record, fields):
+        for key, value in fields.items():
+            if value is self.MISSING:
+                record.pop(key, None)
+            else:
+                record[key] = copy.deepcopy(value)
+    
+    def replay(self, data, source, target, side):
+        if not source:
+            return None
+        command = source.pop()
+        if command['collection'] == 'budgets':
+            self.storage.set_budget(data, command['category'], command[side])
+        else:
+            record = self.storage.find_record(data, command['collection'], command['uid'], command['date'])
+            if record is None:
+                return None
+            self.storage.update_record(data, command['collection'], record,
+                                       lambda r: self.restore(r, command[side]))
+        target.append(command)
+        return command['label']
+    
+    def undo(self, data):
+        return self.replay(data, self.undo_stack, self.redo_stack, 'before')
+    
+    def redo(self, data):
+        return self.replay(data, self.redo_stack, self.undo_stack, 'after')
+    
+    def labels(self):
+        return (self.undo_stack[-1]['label'] if self.undo_stack else None,
+                self.redo_stack[-1]['label'] if self.redo_stack else None)
+
+# Dated exchange rates (value of one unit in DEFAULT_CURRENCY) indexed for as-of lookup
+class FxRates:
+    def __init__(self, filename='fx_rates.json'):
+        self.filename = filename
+        self.version = 0
+        self.rates = {}
+        self.index = {}
+        self.missing = set()
+        self.stamp = None
+        self.digest = None
+        self.refresh()
+    
+    def refresh(self):
+        # Also picks up rates saved by another process
+        stamp = file_stamp(self.filename)
+        if stamp == self.stamp:
+            return False
+        self.stamp = stamp
+        self.rates = {}
+        if stamp is not None:
             with open(self.filename, 'r') as f:
-                return json.load(f)
-        return {'expenses': [], 'income': [], 'loans': []}
+                self.rates = json.load(f)
+        self.index = {}
+        for currency in self.rates:
+            self.reindex(currency)
+        self.version += 1
+        return True
+    
+    def reindex(self, currency):
+        self.rates[currency].sort()
+        self.index[currency] = ([day for day, _ in self.rates[currency]],
+                                [rate for _, rate in self.rates[currency]])
+        self.version += 1
+    
+    def fingerprint(self):
+        # Identifies the rate table across restarts, unlike the in-memory version counter
+        if self.digest is None or self.digest[0] != self.version:
+            content = json.dumps(self.rates, sort_keys=True).encode()
+            self.digest = (self.version, hashlib.sha1(content).hexdigest()[:16])
+        return self.digest[1]
+    
+    def currencies(self):
+        return [DEFAULT_CURRENCY] + sorted(c for c in self.rates if c != DEFAULT_CURRENCY)
+    
+    def set_rate(self, currency, day, rate):
+        self.rates[currency] = [e for e in self.rates.get(currency, []) if e[0] != day] + [[day, rate]]
+        self.reindex(currency)
+        self.missing.discard(currency)
+        write_json(self.filename, self.rates)
+        self.stamp = file_stamp(self.filename)
+    
+    def rate(self, currency, as_of):
+        if currency == DEFAULT_CURRENCY:
+            return 1.0
+        if currency not in self.index:
+            self.missing.add(currency)
+            return 1.0
+        days, rates = self.index[currency]
+        # Month keys ('YYYY-MM') resolve to the rate as of the end of that month
+        pos = bisect_right(days, as_of if len(as_of) == 10 else as_of + '-31')
+        return rates[max(pos - 1, 0)]
+    
+    def convert(self, amounts, base):
+        # amounts: {currency: {date: amount}}, one rate lookup per (currency, date) group
+        total = 0.0
+        for currency, by_date in amounts.items():
+            if currency == base:
+                total += sum(by_date.values())
+                continue
+            for as_of, amount in by_date.items():
+                total += amount * self.rate(currency, as_of) / self.rate(base, as_of)
+        return total
+    
+    @staticmethod
+    def group(records, key):
+        groups = {}
+        for record in records:
+            by_date = groups.setdefault(key(record), {}).setdefault(record.get('currency', DEFAULT_CURRENCY), {})
+            day = record['date'][:10]
+            by_date[day] = by_date.get(day, 0) + record['amount']
+        return groups
+
+# Per-day Fenwick trees (one per year and category/source) for O(log n) range sums
+class DailyIndex:
+    ALL = '*'
+    
+    def __init__(self, storage):
+        self.storage = storage
+        self.years = {}
+    
+    @staticmethod
+    def fenwick_add(tree, i, value):
+        while i < len(tree):
+            tree[i] += value
+            i += i & -i
+    
+    @staticmethod
+    def fenwick_sum(tree, i):
+        total = 0.0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+    
+    def year_index(self, data, year):
+        # Built lazily from the year's shard, in the current base currency
+        key = (base_currency(data), self.storage.fx.version)
+        index = self.years.get(year)
+        if index is None or index['key'] != key:
+            index = self.years[year] = {'key': key, 'trees': {}}
+            shard = self.storage.shard(year)
+            # The trees outlive an evicted shard, so remember which version of the file they were built from
+            index['stamp'] = self.storage.stamps.get(self.storage.shard_filename(year))
+            for collection, field in GROUP_FIELDS.items():
+                live = (r for r in shard[collection] if not r.get('deleted'))
+                groups = FxRates.group(live, key=lambda r: r[field])
+                for group, amounts in groups.items():
+                    for currency, by_day in amounts.items():
+                        for day, amount in by_day.items():
+                            self.add(index, collection, group, day, self.convert(amount, currency, day, key[0]))
+        return index
+    
+    def convert(self, amount, currency, day, base):
+        # Each month converts at its closing rate, the same rate the manifest totals use on the dashboard
+        if currency == base:
+            return amount
+        month = day[:7]
+        return amount * self.storage.fx.rate(currency, month) / self.storage.fx.rate(base, month)
+    
+    def add(self, index, collection, group, day, value):
+        doy = datetime.strptime(day, '%Y-%m-%d').timetuple().tm_yday
+        for name in (group, self.ALL):
+            tree = index['trees'].setdefault((collection, name), [0.0] * 367)
+            self.fenwick_add(tree, doy, value)
+    
+    def update(self, data, collection, record, sign):
+        index = self.years.get(record['date'][:4])
+        if index is None or collection not in GROUP_FIELDS:
+            return
+        base = base_currency(data)
+        if index['key'] != (base, self.storage.fx.version):
+            del self.years[record['date'][:4]]
+            return
+        day = record['date'][:10]
+        value = self.convert(sign * record['amount'], record.get('currency', DEFAULT_CURRENCY), day, base)
+        self.add(index, collection, record[GROUP_FIELDS[collection]], day, value)
+    
+    def years_between(self, data, start, end):
+        stored = set(data['shards']) | {self.storage.current_year}
+        return [str(year) for year in range(start.year, end.year + 1) if str(year) in stored]
+    
+    def range_sum(self, data, collection, group, start, end):
+        total = 0.0
+        for year in self.years_between(data, start, end):
+            tree = self.year_index(data, year)['trees'].get((collection, group))
+            if tree is None:
+                continue
+            first = start.timetuple().tm_yday if start.year == int(year) else 1
+            last = end.timetuple().tm_yday if end.year == int(year) else 366
+            total += self.fenwick_sum(tree, last) - self.fenwick_sum(tree, first - 1)
+        return total
+    
+    def totals(self, data, collection, start, end):
+        groups = set()
+        for year in self.years_between(data, start, end):
+            groups.update(name for c, name in self.year_index(data, year)['trees'] if c == collection)
+        groups.discard(self.ALL)
+        totals = {group: self.range_sum(data, collection, group, start, end) for group in groups}
+        return {group: amount for group, amount in totals.items() if abs(amount) >= 0.005}
+    
+    @staticmethod
+    def buckets(start, end, step):
+        while start <= end:
+            if step == 'Daily':
+                stop, label = start, start.strftime('%Y-%m-%d')
+            elif step == 'Weekly':
+                stop, label = start + timedelta(days=6 - start.weekday()), 'Week of ' + start.strftime('%Y-%m-%d')
+            else:
+                next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+                stop, label = next_month - timedelta(days=1), start.strftime('%b %Y')
+            stop = min(stop, end)
+            yield label, start, stop
+            start = stop + timedelta(days=1)
+    
+    def series(self, data, collection, group, start, end, step):
+        return [(label, self.range_sum(data, collection, group, first, last))
+                for label, first, last in self.buckets(start, end, step)]
+
+# Per-month category spending counters with budget threshold alerts
+class BudgetTracker:
+    THRESHOLDS = (100, 80)
+    
+    def __init__(self, fx):
+        self.fx = fx
+        self.listeners = []
+    
+    def bind(self, callback):
+        self.listeners.append(callback)
+    
+    def ensure(self, data):
+        data.setdefault('budgets', {})
+        data.setdefault('budget_alerts', {})
+        if 'spending' not in data:
+            self.rebuild(data)
+    
+    def rebuild(self, data):
+        data['spending'] = {}
+        for exp in data['expenses']:
+            if not exp.get('deleted'):
+                self.count(data, exp, 1)
+    
+    def count(self, data, expense, sign):
+        month_totals = data['spending'].setdefault(expense['date'][:7], {})
+        totals = month_totals.setdefault(expense['category'], {})
+        currency = expense.get('currency', DEFAULT_CURRENCY)
+        totals[currency] = totals.get(currency, 0) + sign * expense['amount']
+    
+    def record_expense(self, data, expense):
+        self.ensure(data)
+        self.count(data, expense, 1)
+        return self.check(data, expense['date'][:7], expense['category'])
+    
+    def remove_expense(self, data, expense):
+        self.ensure(data)
+        self.count(data, expense, -1)
+        month = expense['date'][:7]
+        fired = data['budget_alerts'].get(month, {})
+        if expense['category'] in fired:
+            level = self.level(self.usage(data, month, expense['category'])[2])
+            fired[expense['category']] = min(fired[expense['category']], level)
+    
+    def usage(self, data, month, category):
+        # Budgets are stored in DEFAULT_CURRENCY; both sides are converted as of the month end
+        self.ensure(data)
+        base = base_currency(data)
+        totals = data['spending'].get(month, {}).get(category, {})
+        budget_amount = self.fx.convert({DEFAULT_CURRENCY: {month: data['budgets'].get(category, 0)}}, base)
+        spent = self.fx.convert({currency: {month: amount} for currency, amount in totals.items()}, base)
+        percentage = (spent / budget_amount * 100) if budget_amount > 0 else 0
+        return budget_amount, spent, percentage
+    
+    def level(self, percentage):
+        # Reaching a threshold exactly counts as crossing it
+        for threshold in self.THRESHOLDS:
+            if percentage >= threshold:
+                return threshold
+        return 0
+    
+    def check(self, data, month, category):
+        budget_amount, spent, percentage = self.usage(data, month, category)
+        if budget_amount <= 0:
+            return None
+        
+        fired = data['budget_alerts'].setdefault(month, {})
+        level = self.level(percentage)
+        if level <= fired.get(category, 0):
+            return None
+        
+        fired[category] = level
+        alert = {'month': month, 'category': category, 'level': level,
+                 'spent': spent, 'budget': budget_amount, 'currency': base_currency(data)}
+        for callback in self.listeners:
+            callback(alert)
+        return alert
+    
+    def set_budget(self, data, category, amount):
+        self.ensure(data)
+        data['budgets'][category] = amount
+        month = datetime.now().strftime('%Y-%m')
+        data['budget_alerts'].setdefault(month, {}).pop(category, None)
+        return self.check(data, month, category)
+    
+    def current_alerts(self, data):
+        self.ensure(data)
+        month = datetime.now().strftime('%Y-%m')
+        alerts = []
+        for category in data['budget_alerts'].get(month, {}):
+            budget_amount, spent, percentage = self.usage(data, month, category)
+            level = self.level(percentage)
+            if budget_amount > 0 and level:
+                alerts.append((category, level, percentage))
+        return sorted(alerts, key=lambda x: x[2], reverse=True)
+    
+    @staticmethod
+    def describe(alert):
+        if alert['level'] >= 100:
+            return f"{alert['category']} budget exceeded: {money(alert['spent'], alert['currency'])} of {money(alert['budget'], alert['currency'])}"
+        return f"{alert['category']} budget {alert['level']}% used: {money(alert['spent'], alert['currency'])} of {money(alert['budget'], alert['currency'])}"
+
+# Rolling per-category weekly spending statistics (Welford mean/variance, EWMA) kept in DEFAULT_CURRENCY
+class SpendingInsights:
+    ALPHA = 0.3
+    MIN_WEEKS = 4
+    Z_THRESHOLD = 2.0
+    MOM_THRESHOLD = 25
+    
+    def __init__(self, storage):
+        self.storage = storage
+    
+    @staticmethod
+    def week_of(day):
+        day = date.fromisoformat(day[:10])
+        return (day - timedelta(days=day.weekday())).isoformat()
+    
+    @staticmethod
+    def weeks_between(start, end):
+        return (date.fromisoformat(end) - date.fromisoformat(start)).days // 7
+    
+    def rebuild(self, data):
+        # One pass over the history; afterwards every expense change is an O(1) update
+        this_week = self.week_of(datetime.now().strftime('%Y-%m-%d'))
+        data['insights'] = {'start': this_week, 'open': this_week, 'n': 0, 'weeks': {}, 'stats': {},
+                            'rates': self.storage.fx.fingerprint()}
+        for expense in self.storage.records(data, 'expenses'):
+            self.update(data, expense, 1)
+    
+    def current(self, data):
+        # Folded amounts depend on the rate table, so a rate change rebuilds instead of letting removals drift
+        if data['insights'].get('rates') != self.storage.fx.fingerprint():
+            self.rebuild(data)
+            return True
+        return False
+    
+    def update(self, data, expense, sign):
+        if data.get('insights') is None:
+            return
+        # A rebuild already sees an added expense as stored, and a removed one as not yet changed
+        if self.current(data) and sign > 0:
+            return
+        state = data['insights']
+        day = expense['date'][:10]
+        week = self.week_of(day)
+        amount = sign * expense['amount'] * self.storage.fx.rate(expense.get('currency', DEFAULT_CURRENCY), day)
+        if week > state['open']:
+            self.advance(state, week)
+        elif week < state['start']:
+            self.extend(state, week)
+        
+        totals = state['weeks'].setdefault(week, {})
+        old = totals.get(expense['category'], 0.0)
+        totals[expense['category']] = old + amount
+        if week < state['open']:
+            self.replace(state, week, expense['category'], old, old + amount)
+    
+    def stat(self, state, category):
+        # A category seen for the first time has been zero in every earlier week
+        return state['stats'].setdefault(category, {'mean': 0.0, 'm2': 0.0, 'ewma': 0.0, 'active': 0})
+    
+    def advance(self, state, week):
+        # Close the open week, then every empty week up to the new one
+        totals = state['weeks'].get(state['open'], {})
+        n = state['n'] + 1
+        for category in set(state['stats']) | set(totals):
+            stat = self.stat(state, category)
+            x = totals.get(category, 0.0)
+            delta = x - stat['mean']
+            stat['mean'] += delta / n
+            stat['m2'] += delta * (x - stat['mean'])
+            stat['ewma'] += self.ALPHA * (x - stat['ewma'])
+            stat['active'] += abs(x) >= 0.005
+        state['n'] = n
+        self.add_empty_weeks(state, self.weeks_between(state['open'], week) - 1, decay=True)
+        state['open'] = week
+    
+    def extend(self, state, week):
+        # An older expense (e.g. pulled by sync) pushes the start of the history back
+        self.add_empty_weeks(state, self.weeks_between(week, state['start']), decay=False)
+        state['start'] = week
+    
+    def add_empty_weeks(self, state, weeks, decay):
+        if weeks <= 0:
+            return
+        n = state['n']
+        for stat in state['stats'].values():
+            stat['m2'] += stat['mean'] ** 2 * n * weeks / (n + weeks)
+            stat['mean'] *= n / (n + weeks)
+            if decay:
+                stat['ewma'] *= (1 - self.ALPHA) ** weeks
+        state['n'] = n + weeks
+    
+    def replace(self, state, week, category, old, new):
+        # A closed week's total changed: swap one observation instead of refolding the history
+        stat = self.stat(state, category)
+        mean = stat['mean'] + (new - old) / state['n']
+        stat['m2'] = max(stat['m2'] + (new - old) * (new + old - stat['mean'] - mean), 0.0)
+        stat['mean'] = mean
+        stat['active'] += (abs(new) >= 0.005) - (abs(old) >= 0.005)
+        age = self.weeks_between(week, state['open']) - 1
+        stat['ewma'] += self.ALPHA * (1 - self.ALPHA) ** age * (new - old)
+    
+    def weekly_anomalies(self, data):
+        self.current(data)
+        state = data['insights']
+        this_week = self.week_of(datetime.now().strftime('%Y-%m-%d'))
+        if this_week > state['open']:
+            self.advance(state, this_week)
+        n = state['n']
+        if n < self.MIN_WEEKS:
+            return []
+        
+        anomalies = []
+        for category, spent in state['weeks'].get(state['open'], {}).items():
+            stat = state['stats'].get(category)
+            # Empty weeks (e.g. before a back-dated expense) shrink the std, so a category needs a few
+            # weeks of actual spending and a non-zero usual amount before this week can stand out
+            if stat is None or stat['active'] < self.MIN_WEEKS or spent <= stat['mean']:
+                continue
+            typical = stat['ewma'] / (1 - (1 - self.ALPHA) ** n)
+            std = (stat['m2'] / (n - 1)) ** 0.5
+            if typical >= 0.005 and spent > typical and std > 0 and (spent - stat['mean']) / std >= self.Z_THRESHOLD:
+                anomalies.append((category, (spent - stat['mean']) / std, typical))
+        return sorted(anomalies, key=lambda x: x[1], reverse=True)
+    
+    def month_changes(self, data):
+        tracker = self.storage.budget_tracker
+        tracker.ensure(data)
+        base = base_currency(data)
+        today = datetime.now()
+        month = today.strftime('%Y-%m')
+        last_month = (today.replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+        
+        changes = []
+        for category in data['spending'].get(month, {}):
+            spent = [self.storage.fx.convert({currency: {m: amount} for currency, amount in
+                                              data['spending'].get(m, {}).get(category, {}).items()}, base)
+                     for m in (last_month, month)]
+            if spent[0] > 0 and (spent[1] - spent[0]) / spent[0] * 100 >= self.MOM_THRESHOLD:
+                changes.append((category, (spent[1] - spent[0]) / spent[0] * 100))
+        return sorted(changes, key=lambda x: x[1], reverse=True)
+    
+    def describe(self, data):
+        base = base_currency(data)
+        today = datetime.now().strftime('%Y-%m-%d')
+        lines = []
+        for category, z, typical in self.weekly_anomalies(data):
+            typical = self.storage.fx.convert({DEFAULT_CURRENCY: {today: typical}}, base)
+            usual = f' (~{money(typical, base)}/week)' if round(typical, 2) else ''
+            lines.append(f'{category} spending this week is {z:.1f}σ above your usual{usual}')
+        for category, percentage in self.month_changes(data):
+            lines.append(f'{category} up {percentage:.0f}% month-over-month')
+        return lines
+
+# Naive Bayes token counts that suggest an expense's category and payment method from its description
+class ExpenseSuggester:
+    FIELDS = ('category', 'payment_method')
+    MIN_CONFIDENCE = 0.6
+    
+    def __init__(self, storage):
+        self.storage = storage
+    
+    @staticmethod
+    def tokens(text):
+        return set(re.findall(r'[a-z0-9]{2,}', text.lower()))
+    
+    def rebuild(self, data):
+        data['suggest'] = {field: {'classes': {}, 'tokens': {}} for field in self.FIELDS}
+        for expense in self.storage.records(data, 'expenses'):
+            self.update(data, expense, 1)
+    
+    def update(self, data, expense, sign):
+        model = data.get('suggest')
+        if model is None:
+            return
+        tokens = self.tokens(expense.get('description', ''))
+        for field in self.FIELDS:
+            label = expense.get(field)
+            if not label:
+                continue
+            table = model[field]
+            totals = table['classes'].setdefault(label, {'docs': 0, 'tokens': 0})
+            totals['docs'] += sign
+            totals['tokens'] += sign * len(tokens)
+            for token in tokens:
+                counts = table['tokens'].setdefault(token, {})
+                counts[label] = counts.get(label, 0) + sign
+                if counts[label] <= 0:
+                    del counts[label]
+                    if not counts:
+                        del table['tokens'][token]
+            if totals['docs'] <= 0:
+                del table['classes'][label]
+    
+    def suggest(self, data, description):
+        # Multinomial naive Bayes with add-one smoothing over the known tokens only
+        suggestions = {}
+        tokens = self.tokens(description)
+        for field, table in data.get('suggest', {}).items():
+            known = [token for token in tokens if token in table['tokens']]
+            classes = table['classes']
+            if not known or not classes:
+                continue
+            docs = sum(totals['docs'] for totals in classes.values())
+            vocabulary = len(table['tokens'])
+            scores = {}
+            for label, totals in classes.items():
+                score = math.log(totals['docs'] / docs)
+                for token in known:
+                    score += math.log((table['tokens'][token].get(label, 0) + 1) / (totals['tokens'] + vocabulary))
+                scores[label] = score
+            best = max(scores, key=scores.get)
+            if 1 / sum(math.exp(score - scores[best]) for score in scores.values()) >= self.MIN_CONFIDENCE:
+                suggestions[field] = best
+        return suggestions
+
+# Loan balances with interest accrual and a due-date index
+class LoanBook:
+    INTEREST_TYPES = {'No Interest': 'none', 'Simple': 'simple', 'Compound': 'compound'}
+    AGING_BUCKETS = (('0-30 days', 0, 30), ('31-60 days', 31, 60), ('60+ days', 61, None))
+    
+    def __init__(self, loans):
+        self.active = {'given': {}, 'taken': {}}
+        self.due_index = {'given': [], 'taken': []}
+        self.undated = {'given': [], 'taken': []}
+        for loan in loans:
+            self.track(loan)
+    
+    @staticmethod
+    def parse_due_date(text):
+        text = text.strip()
+        if not text:
+            return None
+        return datetime.strptime(text, '%Y-%m-%d').date()
+    
+    @staticmethod
+    def due_ordinal(loan):
+        try:
+            due = LoanBook.parse_due_date(loan.get('due_date') or '')
+        except ValueError:
+            return None
+        return due.toordinal() if due else None
+    
+    @staticmethod
+    def prepare(loan, interest_rate=0, interest_type='none'):
+        loan.setdefault('interest_rate', interest_rate)
+        loan.setdefault('interest_type', interest_type)
+        loan.setdefault('principal_outstanding', loan['amount'])
+        loan.setdefault('interest_outstanding', 0.0)
+        loan.setdefault('repaid', 0.0)
+        loan.setdefault('repayments', [])
+        loan.setdefault('accrued_date', loan['date'][:10])
+        return loan
+    
+    @staticmethod
+    def interest_due(loan, as_of):
+        accrued = datetime.strptime(loan['accrued_date'], '%Y-%m-%d').date()
+        days = (as_of - accrued).days
+        rate = loan['interest_rate'] / 100
+        if days <= 0 or rate <= 0 or loan['interest_type'] == 'none':
+            return 0.0
+        if loan['interest_type'] == 'simple':
+            return loan['principal_outstanding'] * rate * days / 365
+        balance = loan['principal_outstanding'] + loan['interest_outstanding']
+        return balance * ((1 + rate / 365) ** days - 1)
+    
+    @staticmethod
+    def accrue(loan, as_of):
+        LoanBook.prepare(loan)
+        loan['interest_outstanding'] += LoanBook.interest_due(loan, as_of)
+        loan['accrued_date'] = max(loan['accrued_date'], as_of.strftime('%Y-%m-%d'))
+    
+    @staticmethod
+    def outstanding(loan, as_of=None):
+        if loan.get('deleted') or loan.get('status', 'active') != 'active':
+            return 0.0
+        LoanBook.prepare(loan)
+        as_of = as_of or datetime.now().date()
+        return loan['principal_outstanding'] + loan['interest_outstanding'] + LoanBook.interest_due(loan, as_of)
+    
+    def track(self, loan):
+        if loan.get('deleted') or loan.get('status', 'active') != 'active' or loan['type'] not in self.active:
+            return
+        LoanBook.prepare(loan)
+        self.active[loan['type']][loan['id']] = loan
+        due = self.due_ordinal(loan)
+        if due is not None:
+            insort(self.due_index[loan['type']], (due, loan['id']))
+        else:
+            insort(self.undated[loan['type']], loan['id'])
+    
+    def untrack(self, loan):
+        if loan['type'] not in self.active:
+            return
+        self.active[loan['type']].pop(loan['id'], None)
+        due = self.due_ordinal(loan)
+        if due is not None:
+            index, key = self.due_index[loan['type']], (due, loan['id'])
+        else:
+            index, key = self.undated[loan['type']], loan['id']
+        pos = bisect_left(index, key)
+        if pos < len(index) and index[pos] == key:
+            index.pop(pos)
+    
+    def repay(self, loan, amount, when=None):
+        when = when or datetime.now()
+        self.accrue(loan, when.date())
+        amount = min(amount, loan['principal_outstanding'] + loan['interest_outstanding'])
+        to_interest = min(amount, loan['interest_outstanding'])
+        loan['interest_outstanding'] -= to_interest
+        loan['principal_outstanding'] -= amount - to_interest
+        loan['repaid'] += amount
+        loan['repayments'].append({'amount': amount, 'date': when.strftime('%Y-%m-%d %H:%M:%S')})
+        
+        if loan['principal_outstanding'] + loan['interest_outstanding'] < 0.005:
+            loan['principal_outstanding'] = loan['interest_outstanding'] = 0.0
+            loan['status'] = 'settled'
+            loan['settled_date'] = when.strftime('%Y-%m-%d %H:%M:%S')
+            self.untrack(loan)
+        return amount
+    
+    def settle(self, loan, when=None):
+        when = when or datetime.now()
+        return self.repay(loan, self.outstanding(loan, when.date()), when)
+    
+    def loans(self, loan_type):
+        # Already in (due date, id) order; loans without a due date come last
+        active = self.active[loan_type]
+        return ([active[loan_id] for _, loan_id in self.due_index[loan_type]] +
+                [active[loan_id] for loan_id in self.undated[loan_type]])
+    
+    def due_between(self, loan_type, start, end):
+        index = self.due_index[loan_type]
+        lo = bisect_left(index, (start.toordinal(),)) if start else 0
+        hi = bisect_left(index, (end.toordinal(),)) if end else len(index)
+        return [self.active[loan_type][loan_id] for _, loan_id in index[lo:hi]]
+    
+    def overdue(self, loan_type, today=None):
+        today = today or datetime.now().date()
+        return self.due_between(loan_type, None, today)
+    
+    def due_this_week(self, loan_type, today=None):
+        today = today or datetime.now().date()
+        return self.due_between(loan_type, today, today + timedelta(days=7))
+    
+    def aging(self, loan_type, today=None):
+        today = today or datetime.now().date()
+        buckets = []
+        for label, min_days, max_days in self.AGING_BUCKETS:
+            start = today - timedelta(days=max_days) if max_days is not None else None
+            end = today - timedelta(days=min_days - 1) if min_days else today
+            buckets.append((label, self.due_between(loan_type, start, end)))
+        return buckets
+
+# Pie, bar and line charts drawn into one instruction group and re-rendered only when data or size changes
+class ChartWidget(Widget):
+    PALETTE = [(0.2, 0.5, 0.8, 1), (0.8, 0.3, 0.3, 1), (0.3, 0.7, 0.3, 1), (0.9, 0.6, 0.2, 1),
+               (0.5, 0.3, 0.8, 1), (0.2, 0.7, 0.7, 1), (0.8, 0.4, 0.6, 1), (0.5, 0.5, 0.5, 1)]
+    
+    def __init__(self, kind='bar', fmt=lambda v: f'{v:,.0f}', **kwargs):
+        super().__init__(**kwargs)
+        self.kind = kind
+        self.fmt = fmt
+        self.items = []
+        self.legend = []
+        self.colors = None
+        self.signature = None
+        
+        # Moving (e.g. scrolling) only updates the translation, never the drawing
+        self.translate = Translate(0, 0)
+        self.group = InstructionGroup()
+        self.canvas.add(PushMatrix())
+        self.canvas.add(self.translate)
+        self.canvas.add(self.group)
+        self.canvas.add(PopMatrix())
+        self.bind(pos=self.move, size=self.redraw)
+    
+    def set_data(self, items, kind=None, legend=None, colors=None):
+        self.kind = kind or self.kind
+        self.items = list(items)
+        self.legend = legend or []
+        self.colors = colors
+        self.redraw()
+    
+    def move(self, *args):
+        self.translate.xy = self.pos
+    
+    def redraw(self, *args):
+        signature = (self.kind, tuple(self.items), tuple(self.legend),
+                     tuple(self.colors or ()), tuple(self.size))
+        if signature == self.signature:
+            return
+        self.signature = signature
+        
+        w, h = self.size
+        self.group.clear()
+        self.group.add(Color(1, 1, 1, 1))
+        self.group.add(RoundedRectangle(pos=(0, 0), size=(w, h), radius=[8]))
+        if not self.items or w < 20 or h < 40:
+            self.text('No data', 8, h / 2 - 8)
+            return
+        getattr(self, 'draw_' + self.kind)(w, h)
+    
+    def color(self, i):
+        return self.colors[i] if self.colors else self.PALETTE[i % len(self.PALETTE)]
+    
+    def text(self, text, x, y, font_size=11):
+        label = CoreLabel(text=text, font_size=font_size, color=(0.2, 0.2, 0.2, 1))
+        label.refresh()
+        self.group.add(Color(1, 1, 1, 1))
+        self.group.add(Rectangle(texture=label.texture, pos=(x, y), size=label.texture.size))
+    
+    def draw_pie(self, w, h):
+        slices = [(label, value) for label, value in self.items if value > 0]
+        total = sum(value for _, value in slices) or 1
+        diameter = min(h - 16, w * 0.45)
+        angle = 0
+        for i, (label, value) in enumerate(slices):
+            sweep = value / total * 360
+            self.group.add(Color(*self.color(i)))
+            self.group.add(Ellipse(pos=(8, (h - diameter) / 2), size=(diameter, diameter),
+                                   angle_start=angle, angle_end=angle + sweep))
+            angle += sweep
+        
+        x = diameter + 20
+        for i, (label, value) in enumerate(slices[:int((h - 8) // 18)]):
+            y = h - 22 - i * 18
+            self.group.add(Color(*self.color(i)))
+            self.group.add(Rectangle(pos=(x, y + 2), size=(10, 10)))
+            self.text(f'{label}  {self.fmt(value)} ({value / total * 100:.1f}%)', x + 16, y)
+    
+    def draw_bar(self, w, h):
+        top = max(max(value for _, value in self.items), 1e-9)
+        slot = w / len(self.items)
+        for i, (label, value) in enumerate(self.items):
+            bar_height = max(value, 0) / top * (h - 44)
+            self.group.add(Color(*self.color(i)))
+            self.group.add(Rectangle(pos=(i * slot + slot * 0.15, 20), size=(slot * 0.7, bar_height)))
+            self.text(label[:10], i * slot + 4, 4, font_size=10)
+            self.text(self.fmt(value), i * slot + 4, 22 + bar_height, font_size=10)
+    
+    def draw_line(self, w, h):
+        rows = [value if isinstance(value, tuple) else (value,) for _, value in self.items]
+        low = min(0, min(min(row) for row in rows))
+        span = (max(max(row) for row in rows) - low) or 1
+        step = (w - 16) / max(len(rows) - 1, 1)
+        plot = lambda i, v: (8 + i * step, 20 + (v - low) / span * (h - 44))
+        
+        self.group.add(Color(0.8, 0.8, 0.8, 1))
+        self.group.add(Line(points=[8, plot(0, 0)[1], w - 8, plot(0, 0)[1]], width=1))
+        for series in range(len(rows[0])):
+            points = [coord for i, row in enumerate(rows) for coord in plot(i, row[series])]
+            self.group.add(Color(*self.color(series)))
+            if len(rows) == 1:
+                self.group.add(Ellipse(pos=(points[0] - 3, points[1] - 3), size=(6, 6)))
+            else:
+                self.group.add(Line(points=points, width=1.5))
+        
+        self.text(self.items[0][0], 8, 2, font_size=10)
+        if len(self.items) > 1:
+            self.text(self.items[-1][0], w - 80, 2, font_size=10)
+        for i, name in enumerate(self.legend):
+            self.group.add(Color(*self.color(i)))
+            self.group.add(Rectangle(pos=(8 + i * 110, h - 16), size=(10, 10)))
+            self.text(name, 24 + i * 110, h - 18, font_size=10)
 
 # Login Screen
 class LoginScreen(Screen):
@@ -124,21 +1410,43 @@ class DashboardScreen(Screen):
         logout_btn = Button(text='Logout', size_hint=(0.2, 1),
                            background_color=(0.8, 0.3, 0.3, 1))
         logout_btn.bind(on_press=self.logout)
+        sync_btn = Button(text='Sync', size_hint=(0.2, 1),
+                         background_color=(0.2, 0.6, 1, 1))
+        sync_btn.bind(on_press=self.show_sync_popup)
+        fx_btn = Button(text='Currency', size_hint=(0.2, 1),
+                       background_color=(0.5, 0.3, 0.8, 1))
+        fx_btn.bind(on_press=self.show_currency_popup)
         header.add_widget(title)
+        header.add_widget(fx_btn)
+        header.add_widget(sync_btn)
         header.add_widget(logout_btn)
         
         data = self.storage.load_data()
-        total_income = sum(item['amount'] for item in data['income'])
-        total_expense = sum(item['amount'] for item in data['expenses'])
-        loans_given = sum(item['amount'] for item in data['loans'] if item['type'] == 'given')
-        loans_taken = sum(item['amount'] for item in data['loans'] if item['type'] == 'taken')
+        total_income = self.storage.total(data, 'income')
+        total_expense = self.storage.total(data, 'expenses')
+        loans_given = self.storage.loans_outstanding(data, data['loans'], 'given')
+        loans_taken = self.storage.loans_outstanding(data, data['loans'], 'taken')
         balance = total_income - total_expense
+        base = base_currency(data)
         
         summary = GridLayout(cols=2, size_hint=(1, 0.25), spacing=10)
-        summary.add_widget(self.create_card('Income', f'Rs. {total_income:,.2f}', (0.3, 0.7, 0.3, 1)))
-        summary.add_widget(self.create_card('Expenses', f'Rs. {total_expense:,.2f}', (0.8, 0.3, 0.3, 1)))
-        summary.add_widget(self.create_card('Balance', f'Rs. {balance:,.2f}', (0.2, 0.5, 0.8, 1)))
-        summary.add_widget(self.create_card('Loans Net', f'Rs. {loans_given - loans_taken:,.2f}', (0.9, 0.6, 0.2, 1)))
+        summary.add_widget(self.create_card('Income', money(total_income, base), (0.3, 0.7, 0.3, 1)))
+        summary.add_widget(self.create_card('Expenses', money(total_expense, base), (0.8, 0.3, 0.3, 1)))
+        summary.add_widget(self.create_card('Balance', money(balance, base), (0.2, 0.5, 0.8, 1)))
+        summary.add_widget(self.create_card('Loans Net', money(loans_given - loans_taken, base), (0.9, 0.6, 0.2, 1)))
+        
+        alerts = self.storage.budget_tracker.current_alerts(data)
+        alert_box = BoxLayout(orientation='vertical', spacing=2)
+        for category, level, percentage in alerts:
+            color = (0.9, 0.2, 0.2, 1) if level >= 100 else (0.9, 0.6, 0.1, 1)
+            alert_box.add_widget(Label(text=f'[b]{category}[/b]: {percentage:.1f}% of monthly budget used',
+                                       markup=True, font_size='13sp', color=color))
+        for line in self.storage.insights.describe(data):
+            alert_box.add_widget(Label(text=line, font_size='13sp', color=(0.2, 0.5, 0.8, 1)))
+        if self.storage.fx.missing:
+            alert_box.add_widget(Label(text=f"No exchange rate for {', '.join(sorted(self.storage.fx.missing))}",
+                                       font_size='13sp', color=(0.9, 0.2, 0.2, 1)))
+        alert_box.size_hint = (1, 0.05 * len(alert_box.children))
         
         nav = GridLayout(cols=2, size_hint=(1, 0.35), spacing=10)
         
@@ -156,9 +1464,23 @@ class DashboardScreen(Screen):
             btn.bind(on_press=lambda x, s=screen: self.navigate(s))
             nav.add_widget(btn)
         
+        undo_label, redo_label = self.storage.history.labels()
+        history = BoxLayout(size_hint=(1, 0.08), spacing=10)
+        undo_btn = Button(text=f'Undo: {undo_label}' if undo_label else 'Undo', disabled=not undo_label,
+                         background_color=(0.5, 0.5, 0.5, 1))
+        undo_btn.bind(on_press=lambda x: self.replay(self.storage.history.undo))
+        redo_btn = Button(text=f'Redo: {redo_label}' if redo_label else 'Redo', disabled=not redo_label,
+                         background_color=(0.5, 0.5, 0.5, 1))
+        redo_btn.bind(on_press=lambda x: self.replay(self.storage.history.redo))
+        history.add_widget(undo_btn)
+        history.add_widget(redo_btn)
+        
         layout.add_widget(header)
         layout.add_widget(summary)
+        if alert_box.children:
+            layout.add_widget(alert_box)
         layout.add_widget(nav)
+        layout.add_widget(history)
         
         self.add_widget(layout)
     
@@ -174,6 +1496,97 @@ class DashboardScreen(Screen):
         card.add_widget(Label(text=value, font_size='24sp', bold=True))
         return card
     
+    def show_sync_popup(self, instance):
+        content = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        
+        server_url = self.storage.load_data().get('sync', {}).get('server_url', 'http://127.0.0.1:8765')
+        url_input = TextInput(text=server_url, hint_text='Sync Server URL', multiline=False,
+                              size_hint=(1, None), height=40)
+        status = Label(text='', font_size='13sp')
+        sync_btn = Button(text='Sync Now', size_hint=(1, None), height=40,
+                         background_color=(0.2, 0.6, 1, 1))
+        
+        content.add_widget(url_input)
+        content.add_widget(status)
+        content.add_widget(sync_btn)
+        
+        popup = Popup(title='Sync Devices', content=content, size_hint=(0.8, 0.45))
+        
+        def sync(x):
+            try:
+                stats = self.storage.sync(url_input.text.strip())
+            except SyncError as e:
+                status.text = str(e)
+                return
+            status.text = (f"Pushed {stats['pushed']}, pulled {stats['pulled']} changes\n"
+                           f"{stats['bytes_sent']:,} bytes sent, {stats['bytes_received']:,} received "
+                           f"in {stats['requests']} requests")
+            self.build_ui()
+        
+        sync_btn.bind(on_press=sync)
+        popup.open()
+    
+    def show_currency_popup(self, instance):
+        content = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        data = self.storage.load_data()
+        
+        base_row = BoxLayout(size_hint=(1, None), height=40, spacing=5)
+        base_spinner = Spinner(text=base_currency(data), values=self.storage.fx.currencies())
+        base_btn = Button(text='Set Base', size_hint=(0.35, 1), background_color=(0.2, 0.6, 1, 1))
+        base_row.add_widget(base_spinner)
+        base_row.add_widget(base_btn)
+        
+        currency_input = TextInput(hint_text='Currency Code (e.g. USD)', multiline=False,
+                                   size_hint=(1, None), height=40)
+        date_input = TextInput(text=datetime.now().strftime('%Y-%m-%d'), hint_text='Rate Date (YYYY-MM-DD)',
+                               multiline=False, size_hint=(1, None), height=40)
+        rate_input = TextInput(hint_text=f'Value of 1 unit in {DEFAULT_CURRENCY}', input_filter='float',
+                               multiline=False, size_hint=(1, None), height=40)
+        rate_btn = Button(text='Save Rate', size_hint=(1, None), height=40,
+                         background_color=(0.3, 0.7, 0.3, 1))
+        status = Label(text='', font_size='13sp')
+        
+        content.add_widget(base_row)
+        content.add_widget(currency_input)
+        content.add_widget(date_input)
+        content.add_widget(rate_input)
+        content.add_widget(rate_btn)
+        content.add_widget(status)
+        
+        popup = Popup(title='Currency & Exchange Rates', content=content, size_hint=(0.85, 0.6))
+        
+        def set_base(x):
+            self.storage.set_setting(data, 'base_currency', base_spinner.text)
+            self.storage.save_data(data)
+            status.text = f'Totals now shown in {base_spinner.text}'
+            self.build_ui()
+        
+        def save_rate(x):
+            currency = currency_input.text.strip().upper()
+            try:
+                day = datetime.strptime(date_input.text.strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+                rate = float(rate_input.text)
+            except ValueError:
+                status.text = 'Enter a YYYY-MM-DD date and a numeric rate'
+                return
+            if len(currency) != 3 or not currency.isalpha() or currency == DEFAULT_CURRENCY or rate <= 0:
+                status.text = 'Enter a 3-letter currency code and a positive rate'
+                return
+            self.storage.fx.set_rate(currency, day, rate)
+            base_spinner.values = self.storage.fx.currencies()
+            status.text = f'1 {currency} = {money(rate)} from {day}'
+            self.build_ui()
+        
+        base_btn.bind(on_press=set_base)
+        rate_btn.bind(on_press=save_rate)
+        popup.open()
+    
+    def replay(self, action):
+        data = self.storage.load_data()
+        if action(data):
+            self.storage.save_data(data)
+        self.build_ui()
+    
     def navigate(self, screen_name):
         if screen_name in self.manager.screen_names:
             screen = self.manager.get_screen(screen_name)
@@ -184,6 +1597,9 @@ class DashboardScreen(Screen):
     def logout(self, instance):
         self.manager.current = 'login'
     
+    def refresh(self):
+        self.build_ui()
+    
     def on_enter(self):
         self.build_ui()
 
@@ -192,6 +1608,9 @@ class AddExpenseScreen(Screen):
     def __init__(self, storage, **kwargs):
         super().__init__(**kwargs)
         self.storage = storage
+        self.budget_alerts = []
+        self.storage.budget_tracker.bind(self.budget_alerts.append)
+        self.suggested = {}
         self.build_ui()
     
     def build_ui(self):
@@ -206,17 +1625,21 @@ class AddExpenseScreen(Screen):
         
         form = BoxLayout(orientation='vertical', spacing=10, size_hint=(1, 0.8))
         
+        amount_row = BoxLayout(size_hint=(1, None), height=40, spacing=5)
         self.amount_input = TextInput(hint_text='Amount', multiline=False, 
-                                      input_filter='float', height=40, size_hint=(1, None))
+                                      input_filter='float', size_hint=(0.7, 1))
+        self.currency_spinner = Spinner(text=DEFAULT_CURRENCY, values=self.storage.fx.currencies(),
+                                        size_hint=(0.3, 1))
+        amount_row.add_widget(self.amount_input)
+        amount_row.add_widget(self.currency_spinner)
         self.description_input = TextInput(hint_text='Description', height=40, 
                                           size_hint=(1, None))
+        self.description_input.bind(text=self.suggest)
         self.category_spinner = Spinner(text='Select Category',
-                                       values=['Food', 'Transport', 'Shopping', 
-                                              'Bills', 'Entertainment', 'Health', 
-                                              'Education', 'Other'],
+                                       values=EXPENSE_CATEGORIES,
                                        height=40, size_hint=(1, None))
         self.payment_spinner = Spinner(text='Payment Method',
-                                      values=['Cash', 'Card', 'UPI', 'Bank Transfer'],
+                                      values=PAYMENT_METHODS,
                                       height=40, size_hint=(1, None))
         
         recurring = BoxLayout(size_hint=(1, None), height=40)
@@ -231,7 +1654,7 @@ class AddExpenseScreen(Screen):
         add_btn.bind(on_press=self.add_expense)
         
         form.add_widget(Label(text=''))
-        form.add_widget(self.amount_input)
+        form.add_widget(amount_row)
         form.add_widget(self.description_input)
         form.add_widget(self.category_spinner)
         form.add_widget(self.payment_spinner)
@@ -259,17 +1682,21 @@ class AddExpenseScreen(Screen):
             data = self.storage.load_data()
             expense = {
                 'amount': amount,
+                'currency': self.currency_spinner.text,
                 'description': description,
                 'category': category,
                 'payment_method': payment,
                 'recurring': recurring,
-                'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'id': len(data['expenses']) + 1
+                'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
-            data['expenses'].append(expense)
+            del self.budget_alerts[:]
+            self.storage.history.add(data, 'expenses', expense, 'Add expense')
             self.storage.save_data(data)
             
-            self.show_popup('Success', 'Expense added successfully!')
+            message = 'Expense added successfully!'
+            for alert in self.budget_alerts:
+                message += '\n' + BudgetTracker.describe(alert)
+            self.show_popup('Success', message)
             self.clear_form()
         except ValueError:
             self.show_popup('Error', 'Please enter a valid amount!')
@@ -280,6 +1707,22 @@ class AddExpenseScreen(Screen):
         self.category_spinner.text = 'Select Category'
         self.payment_spinner.text = 'Payment Method'
         self.recurring_spinner.text = 'No'
+        self.suggested = {}
+    
+    def suggest(self, instance, text):
+        suggestions = self.storage.suggester.suggest(self.storage.load_data(), text)
+        for field, spinner, placeholder in (('category', self.category_spinner, 'Select Category'),
+                                            ('payment_method', self.payment_spinner, 'Payment Method')):
+            # A value the user picked by hand is never overwritten
+            if spinner.text not in (placeholder, self.suggested.get(field)):
+                continue
+            self.suggested[field] = suggestions.get(field)
+            spinner.text = suggestions.get(field, placeholder)
+    
+    def refresh(self):
+        self.currency_spinner.values = self.storage.fx.currencies()
+        if not self.amount_input.text:
+            self.currency_spinner.text = base_currency(self.storage.load_data())
     
     def show_popup(self, title, message):
         popup = Popup(title=title, content=Label(text=message),
@@ -305,13 +1748,17 @@ class AddIncomeScreen(Screen):
         
         form = BoxLayout(orientation='vertical', spacing=10, size_hint=(1, 0.8))
         
+        amount_row = BoxLayout(size_hint=(1, None), height=40, spacing=5)
         self.amount_input = TextInput(hint_text='Amount', multiline=False,
-                                      input_filter='float', height=40, size_hint=(1, None))
+                                      input_filter='float', size_hint=(0.7, 1))
+        self.currency_spinner = Spinner(text=DEFAULT_CURRENCY, values=self.storage.fx.currencies(),
+                                        size_hint=(0.3, 1))
+        amount_row.add_widget(self.amount_input)
+        amount_row.add_widget(self.currency_spinner)
         self.description_input = TextInput(hint_text='Description', height=40,
                                           size_hint=(1, None))
         self.source_spinner = Spinner(text='Income Source',
-                                     values=['Salary', 'Freelance', 'Investment',
-                                            'Gift', 'Loan Returned', 'Business', 'Other'],
+                                     values=INCOME_SOURCES,
                                      height=40, size_hint=(1, None))
         
         recurring = BoxLayout(size_hint=(1, None), height=40)
@@ -326,7 +1773,7 @@ class AddIncomeScreen(Screen):
         add_btn.bind(on_press=self.add_income)
         
         form.add_widget(Label(text=''))
-        form.add_widget(self.amount_input)
+        form.add_widget(amount_row)
         form.add_widget(self.description_input)
         form.add_widget(self.source_spinner)
         form.add_widget(recurring)
@@ -352,13 +1799,13 @@ class AddIncomeScreen(Screen):
             data = self.storage.load_data()
             income = {
                 'amount': amount,
+                'currency': self.currency_spinner.text,
                 'description': description,
                 'source': source,
                 'recurring': recurring,
-                'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'id': len(data['income']) + 1
+                'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
-            data['income'].append(income)
+            self.storage.history.add(data, 'income', income, 'Add income')
             self.storage.save_data(data)
             
             self.show_popup('Success', 'Income added successfully!')
@@ -372,6 +1819,11 @@ class AddIncomeScreen(Screen):
         self.source_spinner.text = 'Income Source'
         self.recurring_spinner.text = 'No'
     
+    def refresh(self):
+        self.currency_spinner.values = self.storage.fx.currencies()
+        if not self.amount_input.text:
+            self.currency_spinner.text = base_currency(self.storage.load_data())
+    
     def show_popup(self, title, message):
         popup = Popup(title=title, content=Label(text=message),
                      size_hint=(0.7, 0.3))
@@ -386,6 +1838,7 @@ class LoansScreen(Screen):
     
     def build_ui(self):
         self.clear_widgets()
+        self.data = self.storage.load_data()
         layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         
         header = BoxLayout(size_hint=(1, 0.1))
@@ -402,10 +1855,13 @@ class LoansScreen(Screen):
         tabs = BoxLayout(size_hint=(1, 0.08), spacing=5)
         given_btn = Button(text='Given', background_color=(0.3, 0.7, 0.3, 1))
         taken_btn = Button(text='Taken', background_color=(0.8, 0.3, 0.3, 1))
+        due_btn = Button(text='Due', background_color=(0.9, 0.6, 0.2, 1))
         given_btn.bind(on_press=lambda x: self.show_loans('given'))
         taken_btn.bind(on_press=lambda x: self.show_loans('taken'))
+        due_btn.bind(on_press=lambda x: self.show_due())
         tabs.add_widget(given_btn)
         tabs.add_widget(taken_btn)
+        tabs.add_widget(due_btn)
         
         self.loan_scroll = ScrollView(size_hint=(1, 0.82))
         self.loan_list = BoxLayout(orientation='vertical', spacing=5, size_hint_y=None)
@@ -421,90 +1877,228 @@ class LoansScreen(Screen):
     
     def show_loans(self, loan_type):
         self.loan_list.clear_widgets()
-        data = self.storage.load_data()
-        loans = [l for l in data['loans'] if l['type'] == loan_type and l.get('status', 'active') == 'active']
+        loans = self.storage.loan_book.loans(loan_type)
         
         if not loans:
             self.loan_list.add_widget(Label(text=f'No {loan_type} loans', size_hint_y=None, height=50))
             return
         
         for loan in loans:
-            card = BoxLayout(orientation='vertical', size_hint_y=None, height=100, padding=10, spacing=5)
-            with card.canvas.before:
-                color = (0.3, 0.7, 0.3, 0.3) if loan_type == 'given' else (0.8, 0.3, 0.3, 0.3)
-                Color(*color)
-                card.rect = RoundedRectangle(pos=card.pos, size=card.size, radius=[5])
-            card.bind(pos=lambda x, y: setattr(x.rect, 'pos', y),
-                     size=lambda x, y: setattr(x.rect, 'size', y))
-            
-            info = BoxLayout(orientation='vertical')
-            info.add_widget(Label(text=f"[b]{loan['person']}[/b] - Rs. {loan['amount']:,.2f}", 
-                                 markup=True, size_hint_y=0.4))
-            info.add_widget(Label(text=f"{loan['description']} | Due: {loan.get('due_date', 'N/A')}", 
-                                 font_size='12sp', size_hint_y=0.3))
-            
-            settle_btn = Button(text='Settle', size_hint=(None, 0.3), width=80)
-            settle_btn.bind(on_press=lambda x, l=loan: self.settle_loan(l))
-            
-            bottom = BoxLayout(size_hint_y=0.3)
-            bottom.add_widget(Label(text=loan['date'][:10], font_size='11sp'))
-            bottom.add_widget(settle_btn)
+            self.loan_list.add_widget(self.create_loan_card(loan))
+    
+    def show_due(self):
+        self.loan_list.clear_widgets()
+        today = datetime.now().date()
+        
+        for loan_type in ('given', 'taken'):
+            self.add_section(f'[b]{loan_type.title()}: Overdue[/b]')
+            for label, loans in self.storage.loan_book.aging(loan_type, today):
+                total = self.storage.loans_outstanding(self.data, loans, loan_type)
+                total = money(total, base_currency(self.data))
+                self.loan_list.add_widget(Label(text=f'{label}: {len(loans)} loans | {total}',
+                                               font_size='13sp', size_hint_y=None, height=30))
+            for loan in self.storage.loan_book.overdue(loan_type, today):
+                self.loan_list.add_widget(self.create_loan_card(loan))
             
-            card.add_widget(info)
-            card.add_widget(bottom)
-            self.loan_list.add_widget(card)
+            self.add_section(f'[b]{loan_type.title()}: Due This Week[/b]')
+            due_soon = self.storage.loan_book.due_this_week(loan_type, today)
+            if not due_soon:
+                self.loan_list.add_widget(Label(text='Nothing due this week', font_size='13sp',
+                                               size_hint_y=None, height=30))
+            for loan in due_soon:
+                self.loan_list.add_widget(self.create_loan_card(loan))
+    
+    def add_section(self, text):
+        self.loan_list.add_widget(Label(text=text, markup=True, font_size='16sp',
+                                       size_hint_y=None, height=40))
+    
+    def create_loan_card(self, loan):
+        card = BoxLayout(orientation='vertical', size_hint_y=None, height=120, padding=10, spacing=5)
+        with card.canvas.before:
+            color = (0.3, 0.7, 0.3, 0.3) if loan['type'] == 'given' else (0.8, 0.3, 0.3, 0.3)
+            Color(*color)
+            card.rect = RoundedRectangle(pos=card.pos, size=card.size, radius=[5])
+        card.bind(pos=lambda x, y: setattr(x.rect, 'pos', y),
+                 size=lambda x, y: setattr(x.rect, 'size', y))
+        
+        outstanding = LoanBook.outstanding(loan)
+        currency = loan.get('currency', DEFAULT_CURRENCY)
+        interest = ''
+        if loan['interest_type'] != 'none':
+            interest = f" | {loan['interest_rate']:g}% {loan['interest_type']}"
+        
+        info = BoxLayout(orientation='vertical')
+        info.add_widget(Label(text=f"[b]{loan['person']}[/b] - {money(outstanding, currency)} of {money(loan['amount'], currency)}",
+                             markup=True, size_hint_y=0.4))
+        info.add_widget(Label(text=f"{loan['description']} | Due: {loan.get('due_date') or 'N/A'}{interest}",
+                             font_size='12sp', size_hint_y=0.3))
+        info.add_widget(Label(text=f"Repaid: {money(loan['repaid'], currency)}", font_size='12sp', size_hint_y=0.3))
+        
+        repay_btn = Button(text='Repay', size_hint=(None, 1), width=70)
+        repay_btn.bind(on_press=lambda x, l=loan: self.show_repay_popup(l))
+        settle_btn = Button(text='Settle', size_hint=(None, 1), width=70)
+        settle_btn.bind(on_press=lambda x, l=loan: self.settle_loan(l))
+        edit_btn = Button(text='Edit', size_hint=(None, 1), width=70)
+        edit_btn.bind(on_press=lambda x, l=loan: self.show_edit_popup(l))
+        delete_btn = Button(text='Delete', size_hint=(None, 1), width=70,
+                           background_color=(0.8, 0.3, 0.3, 1))
+        delete_btn.bind(on_press=lambda x, l=loan: self.delete_loan(l))
+        
+        bottom = BoxLayout(size_hint_y=0.3)
+        bottom.add_widget(Label(text=loan['date'][:10], font_size='11sp'))
+        bottom.add_widget(repay_btn)
+        bottom.add_widget(settle_btn)
+        bottom.add_widget(edit_btn)
+        bottom.add_widget(delete_btn)
+        
+        card.add_widget(info)
+        card.add_widget(bottom)
+        return card
     
     def show_add_popup(self, instance):
         content = BoxLayout(orientation='vertical', padding=10, spacing=10)
         
-        amount_input = TextInput(hint_text='Amount', input_filter='float', multiline=False)
+        amount_row = BoxLayout(spacing=5)
+        amount_input = TextInput(hint_text='Amount', input_filter='float', multiline=False, size_hint=(0.7, 1))
+        currency_spinner = Spinner(text=base_currency(self.data), values=self.storage.fx.currencies(),
+                                   size_hint=(0.3, 1))
+        amount_row.add_widget(amount_input)
+        amount_row.add_widget(currency_spinner)
         person_input = TextInput(hint_text='Person Name', multiline=False)
         desc_input = TextInput(hint_text='Description', multiline=False)
         type_spinner = Spinner(text='Loan Type', values=['given', 'taken'])
         due_input = TextInput(hint_text='Due Date (YYYY-MM-DD)', multiline=False)
         
-        content.add_widget(amount_input)
+        interest = BoxLayout(spacing=5)
+        interest_spinner = Spinner(text='No Interest', values=list(LoanBook.INTEREST_TYPES))
+        rate_input = TextInput(hint_text='Annual Rate %', input_filter='float', multiline=False)
+        interest.add_widget(interest_spinner)
+        interest.add_widget(rate_input)
+        
+        content.add_widget(amount_row)
         content.add_widget(person_input)
         content.add_widget(desc_input)
         content.add_widget(type_spinner)
         content.add_widget(due_input)
+        content.add_widget(interest)
         
         add_btn = Button(text='Add Loan', size_hint=(1, None), height=40)
         content.add_widget(add_btn)
         
-        popup = Popup(title='Add Loan', content=content, size_hint=(0.8, 0.6))
+        popup = Popup(title='Add Loan', content=content, size_hint=(0.8, 0.7))
         
         def add_loan(x):
             try:
-                data = self.storage.load_data()
+                due_date = LoanBook.parse_due_date(due_input.text)
+            except ValueError:
+                self.show_popup('Error', 'Due date must be YYYY-MM-DD!')
+                return
+            if type_spinner.text not in self.storage.loan_book.active:
+                self.show_popup('Error', 'Please select loan type!')
+                return
+            
+            try:
                 loan = {
                     'amount': float(amount_input.text),
+                    'currency': currency_spinner.text,
                     'person': person_input.text,
                     'description': desc_input.text,
                     'type': type_spinner.text,
-                    'due_date': due_input.text,
+                    'due_date': due_date.strftime('%Y-%m-%d') if due_date else '',
                     'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'status': 'active',
-                    'id': len(data['loans']) + 1
+                    'status': 'active'
                 }
-                data['loans'].append(loan)
-                self.storage.save_data(data)
+                LoanBook.prepare(loan, float(rate_input.text or 0),
+                                 LoanBook.INTEREST_TYPES[interest_spinner.text])
+                self.storage.history.add(self.data, 'loans', loan, 'Add loan')
+                self.storage.save_data(self.data)
                 popup.dismiss()
-                self.refresh()
+                self.show_loans(loan['type'])
             except:
                 pass
         
         add_btn.bind(on_press=add_loan)
         popup.open()
     
+    def show_repay_popup(self, loan):
+        content = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        outstanding = money(LoanBook.outstanding(loan), loan.get('currency', DEFAULT_CURRENCY))
+        amount_input = TextInput(hint_text=f'Amount (outstanding {outstanding})',
+                                 input_filter='float', multiline=False, size_hint=(1, None), height=40)
+        repay_btn = Button(text='Record Repayment', size_hint=(1, None), height=40,
+                          background_color=(0.2, 0.6, 1, 1))
+        content.add_widget(amount_input)
+        content.add_widget(repay_btn)
+        
+        popup = Popup(title=f"Repay - {loan['person']}", content=content, size_hint=(0.8, 0.35))
+        
+        def repay(x):
+            try:
+                amount = float(amount_input.text)
+            except ValueError:
+                return
+            if amount <= 0:
+                return
+            self.storage.history.edit(self.data, 'loans', self.current_loan(loan),
+                                      lambda l: self.storage.loan_book.repay(l, amount), 'Loan repayment')
+            self.storage.save_data(self.data)
+            popup.dismiss()
+            self.show_loans(loan['type'])
+        
+        repay_btn.bind(on_press=repay)
+        popup.open()
+    
     def settle_loan(self, loan):
-        data = self.storage.load_data()
-        for l in data['loans']:
-            if l['id'] == loan['id']:
-                l['status'] = 'settled'
-                l['settled_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.storage.save_data(data)
-        self.refresh()
+        self.storage.history.edit(self.data, 'loans', self.current_loan(loan), self.storage.loan_book.settle,
+                                  'Settle loan')
+        self.storage.save_data(self.data)
+        self.show_loans(loan['type'])
+    
+    def show_edit_popup(self, loan):
+        content = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        person_input = TextInput(text=loan['person'], hint_text='Person Name', multiline=False)
+        desc_input = TextInput(text=loan['description'], hint_text='Description', multiline=False)
+        due_input = TextInput(text=loan.get('due_date') or '', hint_text='Due Date (YYYY-MM-DD)', multiline=False)
+        save_btn = Button(text='Save Changes', size_hint=(1, None), height=40,
+                         background_color=(0.2, 0.6, 1, 1))
+        content.add_widget(person_input)
+        content.add_widget(desc_input)
+        content.add_widget(due_input)
+        content.add_widget(save_btn)
+        
+        popup = Popup(title=f"Edit Loan - {loan['person']}", content=content, size_hint=(0.8, 0.5))
+        
+        def save(x):
+            try:
+                due_date = LoanBook.parse_due_date(due_input.text)
+            except ValueError:
+                self.show_popup('Error', 'Due date must be YYYY-MM-DD!')
+                return
+            changes = {'person': person_input.text, 'description': desc_input.text,
+                       'due_date': due_date.strftime('%Y-%m-%d') if due_date else ''}
+            
+            self.storage.history.edit(self.data, 'loans', self.current_loan(loan), lambda l: l.update(changes),
+                                      'Edit loan')
+            self.storage.save_data(self.data)
+            popup.dismiss()
+            self.show_loans(loan['type'])
+        
+        save_btn.bind(on_press=save)
+        popup.open()
+    
+    def delete_loan(self, loan):
+        self.storage.history.delete(self.data, 'loans', self.current_loan(loan), 'Delete loan')
+        self.storage.save_data(self.data)
+        self.show_loans(loan['type'])
+    
+    def current_loan(self, loan):
+        # Cards and popups may outlive a reload that rebased onto another process's commit
+        return self.storage.find_record(self.data, 'loans', loan['uid'], loan['date']) or loan
+    
+    def show_popup(self, title, message):
+        popup = Popup(title=title, content=Label(text=message),
+                     size_hint=(0.7, 0.3))
+        popup.open()
     
     def refresh(self):
         self.build_ui()
@@ -533,9 +2127,7 @@ class SearchScreen(Screen):
         filters = BoxLayout(size_hint=(1, None), height=40, spacing=5)
         self.type_filter = Spinner(text='All', values=['All', 'Expenses', 'Income'])
         self.category_filter = Spinner(text='All Categories',
-                                      values=['All Categories', 'Food', 'Transport', 
-                                             'Shopping', 'Bills', 'Entertainment', 
-                                             'Health', 'Education', 'Other'])
+                                      values=['All Categories'] + EXPENSE_CATEGORIES)
         filters.add_widget(self.type_filter)
         filters.add_widget(self.category_filter)
         
@@ -568,13 +2160,13 @@ class SearchScreen(Screen):
         results = []
         
         if type_filter in ['All', 'Expenses']:
-            for exp in data['expenses']:
+            for exp in self.storage.records(data, 'expenses'):
                 if (search_term in exp['description'].lower() and
                     (category_filter == 'All Categories' or exp['category'] == category_filter)):
                     results.append(('Expense', exp))
         
         if type_filter in ['All', 'Income']:
-            for inc in data['income']:
+            for inc in self.storage.records(data, 'income'):
                 if search_term in inc['description'].lower():
                     results.append(('Income', inc))
         
@@ -585,7 +2177,7 @@ class SearchScreen(Screen):
         
         for item_type, item in results:
             card = BoxLayout(orientation='vertical', size_hint_y=None, 
-                           height=80, padding=8, spacing=3)
+                           height=110, padding=8, spacing=3)
             
             color = (0.8, 0.3, 0.3, 0.2) if item_type == 'Expense' else (0.3, 0.7, 0.3, 0.2)
             with card.canvas.before:
@@ -594,23 +2186,111 @@ class SearchScreen(Screen):
             card.bind(pos=lambda x, y: setattr(x.rect, 'pos', y),
                      size=lambda x, y: setattr(x.rect, 'size', y))
             
-            title_text = f"[b]{item_type}[/b] - Rs. {item['amount']:,.2f}"
+            title_text = f"[b]{item_type}[/b] - {money(item['amount'], item.get('currency', DEFAULT_CURRENCY))}"
             if item_type == 'Expense':
                 title_text += f" ({item['category']})"
             
-            card.add_widget(Label(text=title_text, markup=True, size_hint_y=0.4))
+            collection = 'expenses' if item_type == 'Expense' else 'income'
+            edit_btn = Button(text='Edit', size_hint=(None, 1), width=70)
+            edit_btn.bind(on_press=lambda x, c=collection, r=item: self.show_edit_popup(c, r))
+            delete_btn = Button(text='Delete', size_hint=(None, 1), width=70,
+                               background_color=(0.8, 0.3, 0.3, 1))
+            delete_btn.bind(on_press=lambda x, c=collection, r=item: self.delete_record(c, r))
+            
+            bottom = BoxLayout(size_hint_y=0.3)
+            bottom.add_widget(Label(text=item['date'][:10], font_size='11sp'))
+            bottom.add_widget(edit_btn)
+            bottom.add_widget(delete_btn)
+            
+            card.add_widget(Label(text=title_text, markup=True, size_hint_y=0.35))
             card.add_widget(Label(text=item['description'], font_size='12sp', 
                                  size_hint_y=0.3))
-            card.add_widget(Label(text=item['date'][:10], font_size='11sp', 
-                                 size_hint_y=0.3))
+            card.add_widget(bottom)
             
             self.results_list.add_widget(card)
+    
+    def current_record(self, data, collection, record):
+        # Search results may outlive an evicted shard, so edit the copy storage holds now
+        return self.storage.find_record(data, collection, record['uid'], record['date'])
+    
+    def show_edit_popup(self, collection, record):
+        content = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        
+        amount_row = BoxLayout(spacing=5)
+        amount_input = TextInput(text=str(record['amount']), hint_text='Amount', input_filter='float',
+                                 multiline=False, size_hint=(0.7, 1))
+        currency_spinner = Spinner(text=record.get('currency', DEFAULT_CURRENCY),
+                                   values=self.storage.fx.currencies(), size_hint=(0.3, 1))
+        amount_row.add_widget(amount_input)
+        amount_row.add_widget(currency_spinner)
+        desc_input = TextInput(text=record['description'], hint_text='Description', multiline=False)
+        field = GROUP_FIELDS[collection]
+        group_spinner = Spinner(text=record[field],
+                                values=EXPENSE_CATEGORIES if collection == 'expenses' else INCOME_SOURCES)
+        
+        content.add_widget(amount_row)
+        content.add_widget(desc_input)
+        content.add_widget(group_spinner)
+        payment_spinner = None
+        if collection == 'expenses':
+            payment_spinner = Spinner(text=record['payment_method'], values=PAYMENT_METHODS)
+            content.add_widget(payment_spinner)
+        
+        status = Label(text='', font_size='13sp')
+        save_btn = Button(text='Save Changes', size_hint=(1, None), height=40,
+                         background_color=(0.2, 0.6, 1, 1))
+        content.add_widget(status)
+        content.add_widget(save_btn)
+        
+        noun = 'expense' if collection == 'expenses' else 'income'
+        # The date is fixed: it decides which yearly shard holds the record
+        popup = Popup(title=f"Edit {noun.title()} - {record['date'][:10]}", content=content,
+                      size_hint=(0.8, 0.6))
+        
+        def save(x):
+            try:
+                amount = float(amount_input.text)
+            except ValueError:
+                status.text = 'Please enter a valid amount!'
+                return
+            changes = {'amount': amount, 'currency': currency_spinner.text,
+                       'description': desc_input.text, field: group_spinner.text}
+            if payment_spinner is not None:
+                changes['payment_method'] = payment_spinner.text
+            
+            data = self.storage.load_data()
+            current = self.current_record(data, collection, record)
+            if current is not None:
+                self.storage.history.edit(data, collection, current, lambda r: r.update(changes), f'Edit {noun}')
+                self.storage.save_data(data)
+            popup.dismiss()
+            self.perform_search(None)
+        
+        save_btn.bind(on_press=save)
+        popup.open()
+    
+    def delete_record(self, collection, record):
+        data = self.storage.load_data()
+        current = self.current_record(data, collection, record)
+        if current is not None:
+            noun = 'expense' if collection == 'expenses' else 'income'
+            self.storage.history.delete(data, collection, current, f'Delete {noun}')
+            self.storage.save_data(data)
+        self.perform_search(None)
+
+    def refresh(self):
+        if self.results_list.children:
+            self.perform_search(None)
 
 # Reports Screen
 class ReportsScreen(Screen):
     def __init__(self, storage, **kwargs):
         super().__init__(**kwargs)
         self.storage = storage
+        self.category_chart = ChartWidget('pie', size_hint_y=None, height=220)
+        self.source_chart = ChartWidget('bar', size_hint_y=None, height=200)
+        self.history_chart = ChartWidget('line', size_hint_y=None, height=200)
+        self.series_chart = ChartWidget('line', size_hint_y=None, height=220)
         self.build_ui()
     
     def build_ui(self):
@@ -631,7 +2311,23 @@ class ReportsScreen(Screen):
             btn.bind(on_press=lambda x, p=period: self.generate_report(p))
             period_box.add_widget(btn)
         
-        self.report_scroll = ScrollView(size_hint=(1, 0.82))
+        range_box = BoxLayout(size_hint=(1, 0.08), spacing=5)
+        today = datetime.now().strftime('%Y-%m-%d')
+        self.start_input = TextInput(text=today[:8] + '01', hint_text='From (YYYY-MM-DD)', multiline=False)
+        self.end_input = TextInput(text=today, hint_text='To (YYYY-MM-DD)', multiline=False)
+        self.step_spinner = Spinner(text='Daily', values=['Daily', 'Weekly', 'Monthly'])
+        self.breakdown_spinner = Spinner(text='Totals',
+                                         values=['Totals'] + [f'Expense: {c}' for c in EXPENSE_CATEGORIES] +
+                                                [f'Income: {s}' for s in INCOME_SOURCES])
+        range_btn = Button(text='Show', size_hint=(0.5, 1), background_color=(0.2, 0.6, 1, 1))
+        range_btn.bind(on_press=self.custom_report)
+        range_box.add_widget(self.start_input)
+        range_box.add_widget(self.end_input)
+        range_box.add_widget(self.step_spinner)
+        range_box.add_widget(self.breakdown_spinner)
+        range_box.add_widget(range_btn)
+        
+        self.report_scroll = ScrollView(size_hint=(1, 0.74))
         self.report_content = BoxLayout(orientation='vertical', spacing=10, 
                                        size_hint_y=None, padding=10)
         self.report_content.bind(minimum_height=self.report_content.setter('height'))
@@ -639,38 +2335,58 @@ class ReportsScreen(Screen):
         
         layout.add_widget(header)
         layout.add_widget(period_box)
+        layout.add_widget(range_box)
         layout.add_widget(self.report_scroll)
         
         self.add_widget(layout)
         self.generate_report('This Month')
     
     def generate_report(self, period):
-        self.report_content.clear_widgets()
+        self.view = (self.generate_report, (period,))
         data = self.storage.load_data()
         
-        now = datetime.now()
+        today = datetime.now().date()
+        end_date = today
         if period == 'This Week':
-            start_date = now - timedelta(days=now.weekday())
+            start_date = today - timedelta(days=today.weekday())
         elif period == 'This Month':
-            start_date = now.replace(day=1)
+            start_date = today.replace(day=1)
         elif period == 'Last Month':
-            last_month = now.replace(day=1) - timedelta(days=1)
-            start_date = last_month.replace(day=1)
-            now = now.replace(day=1)
+            end_date = today.replace(day=1) - timedelta(days=1)
+            start_date = end_date.replace(day=1)
         elif period == 'This Year':
-            start_date = now.replace(month=1, day=1)
+            start_date = today.replace(month=1, day=1)
         else:
-            start_date = datetime(2000, 1, 1)
+            start_date = date(int(min(data['shards'], default=today.year)), 1, 1)
         
-        expenses = [e for e in data['expenses'] 
-                   if datetime.strptime(e['date'], '%Y-%m-%d %H:%M:%S') >= start_date
-                   and datetime.strptime(e['date'], '%Y-%m-%d %H:%M:%S') <= now]
-        income = [i for i in data['income']
-                 if datetime.strptime(i['date'], '%Y-%m-%d %H:%M:%S') >= start_date
-                 and datetime.strptime(i['date'], '%Y-%m-%d %H:%M:%S') <= now]
+        self.show_report(data, period, start_date, end_date)
+    
+    def custom_report(self, instance):
+        try:
+            start_date = datetime.strptime(self.start_input.text.strip(), '%Y-%m-%d').date()
+            end_date = datetime.strptime(self.end_input.text.strip(), '%Y-%m-%d').date()
+        except ValueError:
+            Popup(title='Error', content=Label(text='Dates must be YYYY-MM-DD!'),
+                  size_hint=(0.7, 0.3)).open()
+            return
+        if start_date > end_date:
+            start_date, end_date = end_date, start_date
+        self.range_report(start_date, end_date, self.step_spinner.text, self.breakdown_spinner.text)
+    
+    def range_report(self, start_date, end_date, step, breakdown):
+        self.view = (self.range_report, (start_date, end_date, step, breakdown))
+        data = self.storage.load_data()
+        self.show_report(data, f"{start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}", start_date, end_date)
+        self.show_series(data, start_date, end_date, step, breakdown)
+    
+    def show_report(self, data, period, start_date, end_date):
+        self.report_content.clear_widgets()
+        base = base_currency(data)
+        key = ('report', start_date, end_date, base)
+        categories, sources = self.storage.cached(key, lambda: self.summarize(data, start_date, end_date))
         
-        total_expense = sum(e['amount'] for e in expenses)
-        total_income = sum(i['amount'] for i in income)
+        total_expense = sum(categories.values())
+        total_income = sum(sources.values())
         balance = total_income - total_expense
         
         summary = BoxLayout(orientation='vertical', size_hint_y=None, height=120, padding=10)
@@ -682,78 +2398,71 @@ class ReportsScreen(Screen):
         
         summary.add_widget(Label(text=f'[b]{period} Summary[/b]', markup=True, 
                                 font_size='18sp', size_hint_y=0.3))
-        summary.add_widget(Label(text=f'Income: Rs. {total_income:,.2f} | Expenses: Rs. {total_expense:,.2f}',
+        summary.add_widget(Label(text=f'Income: {money(total_income, base)} | Expenses: {money(total_expense, base)}',
                                 font_size='14sp', size_hint_y=0.35))
         color_text = '[color=00ff00]' if balance >= 0 else '[color=ff0000]'
-        summary.add_widget(Label(text=f'{color_text}Balance: Rs. {balance:,.2f}[/color]',
+        summary.add_widget(Label(text=f'{color_text}Balance: {money(balance, base)}[/color]',
                                 markup=True, font_size='16sp', size_hint_y=0.35))
         
         self.report_content.add_widget(summary)
         
-        if expenses:
-            cat_title = Label(text='[b]Expense by Category[/b]', markup=True,
-                            font_size='16sp', size_hint_y=None, height=40)
-            self.report_content.add_widget(cat_title)
-            
-            categories = defaultdict(float)
-            for exp in expenses:
-                categories[exp['category']] += exp['amount']
-            
-            for cat, amount in sorted(categories.items(), key=lambda x: x[1], reverse=True):
-                percentage = (amount / total_expense * 100) if total_expense > 0 else 0
-                
-                cat_card = BoxLayout(orientation='vertical', size_hint_y=None, 
-                                    height=60, padding=8)
-                with cat_card.canvas.before:
-                    Color(0.9, 0.9, 0.9, 1)
-                    cat_card.rect = RoundedRectangle(pos=cat_card.pos, 
-                                                     size=cat_card.size, radius=[5])
-                cat_card.bind(pos=lambda x, y: setattr(x.rect, 'pos', y),
-                            size=lambda x, y: setattr(x.rect, 'size', y))
-                
-                cat_card.add_widget(Label(text=f'[b]{cat}[/b]', markup=True, 
-                                         size_hint_y=0.5))
-                cat_card.add_widget(Label(text=f'Rs. {amount:,.2f} ({percentage:.1f}%)',
-                                         font_size='13sp', size_hint_y=0.5))
-                
-                self.report_content.add_widget(cat_card)
-        
-        if income:
-            inc_title = Label(text='[b]Income by Source[/b]', markup=True,
-                            font_size='16sp', size_hint_y=None, height=40)
-            self.report_content.add_widget(inc_title)
-            
-            sources = defaultdict(float)
-            for inc in income:
-                sources[inc['source']] += inc['amount']
-            
-            for source, amount in sorted(sources.items(), key=lambda x: x[1], reverse=True):
-                percentage = (amount / total_income * 100) if total_income > 0 else 0
-                
-                src_card = BoxLayout(orientation='vertical', size_hint_y=None,
-                                    height=60, padding=8)
-                with src_card.canvas.before:
-                    Color(0.9, 0.95, 0.9, 1)
-                    src_card.rect = RoundedRectangle(pos=src_card.pos,
-                                                     size=src_card.size, radius=[5])
-                src_card.bind(pos=lambda x, y: setattr(x.rect, 'pos', y),
-                            size=lambda x, y: setattr(x.rect, 'size', y))
-                
-                src_card.add_widget(Label(text=f'[b]{source}[/b]', markup=True,
-                                         size_hint_y=0.5))
-                src_card.add_widget(Label(text=f'Rs. {amount:,.2f} ({percentage:.1f}%)',
-                                         font_size='13sp', size_hint_y=0.5))
-                
-                self.report_content.add_widget(src_card)
+        fmt = lambda v: money(v, base)
+        if categories:
+            self.add_chart('Expense by Category', self.category_chart, fmt,
+                           sorted(categories.items(), key=lambda x: x[1], reverse=True))
+        if sources:
+            self.add_chart('Income by Source', self.source_chart, fmt,
+                           sorted(sources.items(), key=lambda x: x[1], reverse=True))
+        
+        today = datetime.now().date()
+        first_month = (today.replace(day=1) - timedelta(days=334)).replace(day=1)
+        daily = self.storage.daily
+        expenses = daily.series(data, 'expenses', DailyIndex.ALL, first_month, today, 'Monthly')
+        income = daily.series(data, 'income', DailyIndex.ALL, first_month, today, 'Monthly')
+        self.add_chart('Monthly History', self.history_chart, fmt,
+                       [(label, (spent, earned)) for (label, spent), (_, earned) in zip(expenses, income)],
+                       legend=['Expenses', 'Income'], colors=[(0.8, 0.3, 0.3, 1), (0.3, 0.7, 0.3, 1)])
+    
+    def add_chart(self, title, chart, fmt, items, **kwargs):
+        self.report_content.add_widget(Label(text=f'[b]{title}[/b]', markup=True,
+                                            font_size='16sp', size_hint_y=None, height=40))
+        chart.fmt = fmt
+        chart.set_data(items, **kwargs)
+        self.report_content.add_widget(chart)
+    
+    def summarize(self, data, start_date, end_date):
+        daily = self.storage.daily
+        return (daily.totals(data, 'expenses', start_date, end_date),
+                daily.totals(data, 'income', start_date, end_date))
+    
+    def show_series(self, data, start_date, end_date, step, breakdown):
+        base = base_currency(data)
+        daily = self.storage.daily
+        if breakdown == 'Totals':
+            columns = [('Expenses', 'expenses', DailyIndex.ALL), ('Income', 'income', DailyIndex.ALL)]
+        elif breakdown.startswith('Expense: '):
+            columns = [(breakdown[9:], 'expenses', breakdown[9:])]
+        else:
+            columns = [(breakdown[8:], 'income', breakdown[8:])]
+        
+        series = [daily.series(data, collection, group, start_date, end_date, step)
+                  for _, collection, group in columns]
+        items = [(row[0][0], tuple(value for _, value in row)) for row in zip(*series)]
+        colors = [(0.8, 0.3, 0.3, 1), (0.3, 0.7, 0.3, 1)] if breakdown == 'Totals' else None
+        self.add_chart(f'{step} {breakdown}', self.series_chart, lambda v: money(v, base), items,
+                       legend=[name for name, _, _ in columns], colors=colors)
     
     def refresh(self):
-        self.build_ui()
+        # Re-run the period or range on display instead of resetting to This Month
+        report, args = self.view
+        report(*args)
 
 # Budget Planner Screen
 class BudgetScreen(Screen):
     def __init__(self, storage, **kwargs):
         super().__init__(**kwargs)
         self.storage = storage
+        self.chart = ChartWidget('bar', fmt=lambda v: f'{v:.0f}%', size_hint_y=None, height=180)
         self.build_ui()
     
     def build_ui(self):
@@ -786,41 +2495,34 @@ class BudgetScreen(Screen):
     def load_budgets(self):
         self.budget_list.clear_widgets()
         data = self.storage.load_data()
-        
-        if 'budgets' not in data:
-            data['budgets'] = {}
-        
-        budgets = data.get('budgets', {})
-        
-        now = datetime.now()
-        start_of_month = now.replace(day=1)
-        expenses = [e for e in data['expenses']
-                   if datetime.strptime(e['date'], '%Y-%m-%d %H:%M:%S') >= start_of_month]
-        
-        spending = defaultdict(float)
-        for exp in expenses:
-            spending[exp['category']] += exp['amount']
-        
-        categories = ['Food', 'Transport', 'Shopping', 'Bills', 
-                     'Entertainment', 'Health', 'Education', 'Other']
-        
-        for category in categories:
-            budget_amount = budgets.get(category, 0)
-            spent = spending.get(category, 0)
-            remaining = budget_amount - spent
-            percentage = (spent / budget_amount * 100) if budget_amount > 0 else 0
-            
-            card = BoxLayout(orientation='vertical', size_hint_y=None,
-                           height=100, padding=10, spacing=5)
-            
+        tracker = self.storage.budget_tracker
+        month = datetime.now().strftime('%Y-%m')
+        base = base_currency(data)
+        
+        usages = []
+        for category in EXPENSE_CATEGORIES:
+            budget_amount, spent, percentage = tracker.usage(data, month, category)
+            level = tracker.level(percentage)
             if budget_amount == 0:
                 color = (0.7, 0.7, 0.7, 0.3)
-            elif percentage > 100:
+            elif level >= 100:
                 color = (0.9, 0.2, 0.2, 0.4)
-            elif percentage > 80:
+            elif level >= 80:
                 color = (0.9, 0.7, 0.2, 0.4)
             else:
                 color = (0.3, 0.8, 0.3, 0.4)
+            usages.append((category, budget_amount, spent, percentage, color))
+        
+        budgeted = [u for u in usages if u[1] > 0]
+        self.chart.set_data([(category, percentage) for category, _, _, percentage, _ in budgeted],
+                            colors=[color[:3] + (1,) for _, _, _, _, color in budgeted])
+        self.budget_list.add_widget(self.chart)
+        
+        for category, budget_amount, spent, percentage, color in usages:
+            remaining = budget_amount - spent
+            
+            card = BoxLayout(orientation='vertical', size_hint_y=None,
+                           height=100, padding=10, spacing=5)
             
             with card.canvas.before:
                 Color(*color)
@@ -832,9 +2534,9 @@ class BudgetScreen(Screen):
                                  font_size='16sp', size_hint_y=0.3))
             
             if budget_amount > 0:
-                card.add_widget(Label(text=f'Budget: Rs. {budget_amount:,.2f} | Spent: Rs. {spent:,.2f}',
+                card.add_widget(Label(text=f'Budget: {money(budget_amount, base)} | Spent: {money(spent, base)}',
                                      font_size='13sp', size_hint_y=0.35))
-                card.add_widget(Label(text=f'Remaining: Rs. {remaining:,.2f} ({percentage:.1f}%)',
+                card.add_widget(Label(text=f'Remaining: {money(remaining, base)} ({percentage:.1f}%)',
                                      font_size='13sp', size_hint_y=0.35))
             else:
                 card.add_widget(Label(text='No budget set', font_size='13sp',
@@ -846,11 +2548,10 @@ class BudgetScreen(Screen):
         content = BoxLayout(orientation='vertical', padding=10, spacing=10)
         
         category_spinner = Spinner(text='Select Category',
-                                  values=['Food', 'Transport', 'Shopping',
-                                         'Bills', 'Entertainment', 'Health',
-                                         'Education', 'Other'],
+                                  values=EXPENSE_CATEGORIES,
                                   size_hint=(1, None), height=40)
-        amount_input = TextInput(hint_text='Budget Amount', input_filter='float',
+        base = base_currency(self.storage.load_data())
+        amount_input = TextInput(hint_text=f'Budget Amount ({base})', input_filter='float',
                                multiline=False, size_hint=(1, None), height=40)
         
         content.add_widget(category_spinner)
@@ -858,10 +2559,13 @@ class BudgetScreen(Screen):
         
         set_btn = Button(text='Set Budget', size_hint=(1, None), height=40,
                         background_color=(0.2, 0.6, 1, 1))
+        remove_btn = Button(text='Remove Budget', size_hint=(1, None), height=40,
+                           background_color=(0.8, 0.3, 0.3, 1))
         content.add_widget(set_btn)
+        content.add_widget(remove_btn)
         
         popup = Popup(title='Set Category Budget', content=content,
-                     size_hint=(0.8, 0.4))
+                     size_hint=(0.8, 0.45))
         
         def set_budget(x):
             try:
@@ -872,24 +2576,41 @@ class BudgetScreen(Screen):
                     return
                 
                 data = self.storage.load_data()
-                if 'budgets' not in data:
-                    data['budgets'] = {}
-                data['budgets'][category] = amount
+                # Budgets are kept in DEFAULT_CURRENCY so changing the base currency keeps them valid
+                amount *= self.storage.fx.rate(base, datetime.now().strftime('%Y-%m'))
+                alert = self.storage.history.set_budget(data, category, amount, f'Set {category} budget')
                 self.storage.save_data(data)
                 
                 popup.dismiss()
                 self.load_budgets()
+                if alert:
+                    Popup(title='Budget Alert', content=Label(text=BudgetTracker.describe(alert)),
+                          size_hint=(0.8, 0.3)).open()
             except:
                 pass
         
+        def remove_budget(x):
+            category = category_spinner.text
+            data = self.storage.load_data()
+            if not data.get('budgets', {}).get(category):
+                return
+            self.storage.history.set_budget(data, category, 0, f'Remove {category} budget')
+            self.storage.save_data(data)
+            popup.dismiss()
+            self.load_budgets()
+        
         set_btn.bind(on_press=set_budget)
+        remove_btn.bind(on_press=remove_budget)
         popup.open()
     
     def refresh(self):
-        self.build_ui()
+        # The chart is kept across visits, so only the list contents are rebuilt
+        self.load_budgets()
 
 # Main App
 class ExpenseTrackerApp(App):
+    POLL_INTERVAL = 2
+    
     def build(self):
         self.storage = SecureStorage()
         
@@ -903,7 +2624,15 @@ class ExpenseTrackerApp(App):
         sm.add_widget(ReportsScreen(self.storage, name='reports'))
         sm.add_widget(BudgetScreen(self.storage, name='budget'))
         
+        Clock.schedule_interval(self.poll_changes, self.POLL_INTERVAL)
         return sm
+    
+    def poll_changes(self, dt):
+        # Another process committed: refresh only the screen on display, the rest refresh on entry
+        if self.storage.poll():
+            screen = self.root.current_screen
+            if screen.name != 'login' and hasattr(screen, 'refresh'):
+                screen.refresh()
 
 if __name__ == '__main__':
     ExpenseTrackerApp().run()
\ No newline at end of file
@@ -0,0 +1,344 @@
+import argparse
+import copy
+import hashlib
+import http.client
+import json
+import os
+import threading
+import uuid
+import zlib
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+RECORD_COLLECTIONS = ('expenses', 'income', 'loans')
+BATCH_SIZE = 200
+
+class SyncError(Exception):
+    pass
+
+# Version vector helpers shared by the client and the reference server
+def dominates(a, b):
+    return all(a.get(device, 0) >= counter for device, counter in b.items())
+
+def merge_versions(a, b):
+    merged = dict(a)
+    for device, counter in b.items():
+        merged[device] = max(merged.get(device, 0), counter)
+    return merged
+
+def resolve(a, b):
+    # Concurrent edits: every replica picks the same winner regardless of arrival order
+    rank = lambda change: (sum(change['vv'].values()), json.dumps(change['record'], sort_keys=True))
+    winner = max(a, b, key=rank)
+    return {'collection': winner['collection'], 'uid': winner['uid'],
+            'record': winner['record'], 'vv': merge_versions(a['vv'], b['vv'])}
+
+def pack(payload):
+    return zlib.compress(json.dumps(payload, separators=(',', ':')).encode())
+
+def unpack(body):
+    return json.loads(zlib.decompress(body))
+
+# Per-record change log. Version vectors live on the records and the uids waiting to be pushed beside
+# them (the yearly shard, or the main file for loans and budgets), so data['sync'] stays a few fields
+class ChangeLog:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def ensure(self, data, records=()):
+        state = data.get('sync')
+        if state is None:
+            state = data['sync'] = {'device_id': uuid.uuid4().hex[:12], 'server_seq': 0,
+                                    'pending': {}, 'years': [], 'versions': {}}
+            for collection, record in records:
+                record.setdefault('uid', self.legacy_uid(collection, record))
+                self.record_change(data, collection, record)
+            for category, amount in data.get('budgets', {}).items():
+                self.record_change(data, 'budgets', {'category': category, 'amount': amount})
+        return state
+
+    @staticmethod
+    def new_uid():
+        return uuid.uuid4().hex[:16]
+
+    @staticmethod
+    def legacy_uid(collection, record):
+        content = json.dumps([collection, record], sort_keys=True)
+        return 'legacy-' + hashlib.sha1(content.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def has_pending(data):
+        return bool(data['sync']['pending'] or data['sync']['years'])
+
+    def local(self, data, cache, collection, uid, day):
+        # Budgets have no stored record; their few vectors stay in data['sync']['versions']
+        if collection == 'budgets':
+            return None
+        key = (collection, day[:4])
+        if key not in cache:
+            cache[key] = self.storage.records_by_uid(data, collection, day)
+        return cache[key].get(uid)
+
+    def versions(self, data, collection, uid, record):
+        if collection == 'budgets':
+            return data['sync']['versions'].get(uid, {})
+        return record.get('vv', {}) if record is not None else {}
+
+    def set_versions(self, data, collection, uid, record, vv):
+        if collection == 'budgets':
+            data['sync']['versions'][uid] = vv
+        else:
+            record['vv'] = vv
+
+    def change(self, data, collection, uid, record):
+        # The wire form of a local record: its vector travels beside it and the local id not at all
+        vv = self.versions(data, collection, uid, record)
+        if collection == 'budgets':
+            category = uid[len('budget-'):]
+            record = {'category': category, 'amount': data.get('budgets', {}).get(category, 0)}
+        else:
+            record = {k: v for k, v in record.items() if k not in ('id', 'vv')}
+        return {'collection': collection, 'uid': uid, 'vv': vv, 'record': record}
+
+    def record_change(self, data, collection, record):
+        # Nothing is logged until the first sync; ensure() then logs every record once
+        state = data.get('sync')
+        if state is None:
+            return
+        device = state['device_id']
+        if collection == 'budgets':
+            uid = 'budget-' + record['category']
+        else:
+            uid = record.setdefault('uid', self.new_uid())
+        vv = dict(self.versions(data, collection, uid, record))
+        vv[device] = vv.get(device, 0) + 1
+        self.set_versions(data, collection, uid, record, vv)
+        self.storage.mark_pending(data, collection, uid, record.get('date'), True)
+
+    def batch(self, data, limit):
+        # Deep copies, so the batch can be sent after the storage lock is released
+        return [copy.deepcopy(self.change(data, collection, uid, record))
+                for collection, uid, record in self.storage.pending_records(data, limit)]
+
+    def acknowledge(self, data, sent):
+        # A change edited again while its batch was in flight stays pending with its newer version
+        cache = {}
+        for change in sent:
+            collection, uid, day = change['collection'], change['uid'], change['record'].get('date')
+            local = self.local(data, cache, collection, uid, day)
+            if self.versions(data, collection, uid, local) == change['vv']:
+                self.storage.mark_pending(data, collection, uid, day, False)
+
+    def merge(self, data, incoming):
+        state = self.ensure(data)
+        accepted = []
+        cache = {}
+        for change in incoming:
+            collection, uid, day = change['collection'], change['uid'], change['record'].get('date')
+            local = self.local(data, cache, collection, uid, day)
+            local_vv = self.versions(data, collection, uid, local)
+            if dominates(local_vv, change['vv']):
+                continue
+
+            if uid in self.storage.pending(data, collection, day) and not dominates(change['vv'], local_vv):
+                mine = self.change(data, collection, uid, local)
+                winner = resolve(mine, change)
+                if winner['record'] is mine['record']:
+                    # Ours stays pending, now covering the version it beat
+                    self.set_versions(data, collection, uid, local, winner['vv'])
+                    self.storage.mark_pending(data, collection, uid, day, True)
+                    continue
+                self.storage.mark_pending(data, collection, uid, day, False)
+            else:
+                winner = dict(change, vv=merge_versions(local_vv, change['vv']))
+            if collection == 'budgets':
+                state['versions'][uid] = winner['vv']
+            else:
+                winner['record'] = dict(winner['record'], vv=winner['vv'])
+            winner['known'] = local is not None
+            accepted.append(winner)
+        return accepted
+
+# Delta sync over a single reused, deflate-compressed HTTP connection
+class SyncClient:
+    def __init__(self, url, timeout=10):
+        parts = urlsplit(url)
+        if parts.scheme != 'http' or not parts.hostname:
+            raise SyncError(f'Invalid sync server URL: {url}')
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path.rstrip('/') + '/sync'
+        self.timeout = timeout
+        self.connection = None
+        self.stats = {}
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def request(self, payload):
+        body = pack(payload)
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request('POST', self.path, body,
+                                        {'Content-Type': 'application/json',
+                                         'Content-Encoding': 'deflate'})
+                response = self.connection.getresponse()
+                raw = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                # Stale keep-alive connection; merges are idempotent so one retry is safe
+                self.close()
+                if attempt:
+                    raise SyncError(f'Sync server unreachable: {e}')
+                continue
+            if response.status != 200:
+                raise SyncError(f'Sync server returned {response.status}')
+            try:
+                # Anything but a sync server (a wrong URL, a proxy page) must not escape to the UI
+                response = unpack(raw)
+                changes = [{k: change[k] for k in ('collection', 'uid', 'record', 'vv')}
+                           for change in response['changes']]
+                response = {'changes': changes, 'seq': int(response['seq']), 'more': bool(response['more'])}
+            except (zlib.error, ValueError, KeyError, TypeError) as e:
+                raise SyncError(f'Invalid response from sync server: {e}')
+            self.stats['requests'] += 1
+            self.stats['bytes_sent'] += len(body)
+            self.stats['bytes_received'] += len(raw)
+            return response
+
+    def sync(self, transaction, changelog, apply):
+        # transaction() is a short critical section on the local data: one snapshots the batch to send,
+        # the next merges the reply, and the request itself runs with no lock held
+        self.stats = {'requests': 0, 'pushed': 0, 'pulled': 0, 'bytes_sent': 0, 'bytes_received': 0}
+        while True:
+            with transaction(save=False) as data:
+                state = data['sync']
+                payload = {'device': state['device_id'], 'since': state['server_seq'], 'limit': BATCH_SIZE,
+                           'changes': changelog.batch(data, BATCH_SIZE)}
+            response = self.request(payload)
+
+            with transaction() as data:
+                changelog.acknowledge(data, payload['changes'])
+                apply(data, changelog.merge(data, response['changes']))
+                state = data['sync']
+                # Another process sharing this device may have pulled further in the meantime
+                state['server_seq'] = max(state['server_seq'], response['seq'])
+                # An empty batch also ends the loop, should a pending uid have lost its record
+                done = not (payload['changes'] and changelog.has_pending(data)) and not response['more']
+            self.stats['pushed'] += len(payload['changes'])
+            self.stats['pulled'] += len(response['changes'])
+            if done:
+                return self.stats
+
+# Local reference sync server
+class SyncServer(ThreadingHTTPServer):
+    def __init__(self, address, filename=None):
+        super().__init__(address, SyncRequestHandler)
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.records = {}
+        self.log = []
+        self.seq = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        if filename and os.path.exists(filename):
+            with open(filename, 'r') as f:
+                saved = json.load(f)
+            self.seq = saved['seq']
+            self.records = saved['records']
+            self.compact()
+
+    def compact(self):
+        self.log = sorted((entry['seq'], uid) for uid, entry in self.records.items())
+
+    def save(self):
+        if self.filename:
+            with open(self.filename, 'w') as f:
+                json.dump({'seq': self.seq, 'records': self.records}, f)
+
+    def push(self, device, changes):
+        for change in changes:
+            current = self.records.get(change['uid'])
+            if current and dominates(current['vv'], change['vv']):
+                continue
+            if current and not dominates(change['vv'], current['vv']):
+                winner, origin = resolve(current, change), None
+            else:
+                winner, origin = change, device
+            self.seq += 1
+            self.records[change['uid']] = dict(winner, seq=self.seq, origin=origin)
+            self.log.append((self.seq, change['uid']))
+        if len(self.log) > 2 * len(self.records):
+            self.compact()
+
+    def pull(self, device, since, limit):
+        changes = []
+        last = self.seq
+        for seq, uid in self.log[bisect_left(self.log, (since + 1,)):]:
+            entry = self.records[uid]
+            if entry['seq'] != seq or entry['origin'] == device:
+                continue
+            changes.append({k: entry[k] for k in ('collection', 'uid', 'record', 'vv')})
+            if len(changes) >= limit:
+                last = seq
+                break
+        return changes, last
+
+    def handle_sync(self, payload):
+        with self.lock:
+            self.push(payload['device'], payload['changes'])
+            changes, last = self.pull(payload['device'], payload['since'], payload.get('limit', BATCH_SIZE))
+            if payload['changes']:
+                self.save()
+            return {'changes': changes, 'seq': last, 'more': last < self.seq}
+
+class SyncRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.rstrip('/').endswith('/sync'):
+            self.send_error(404)
+            return
+        try:
+            if self.headers.get('Content-Encoding') == 'deflate':
+                payload = unpack(body)
+            else:
+                payload = json.loads(body)
+            response = pack(self.server.handle_sync(payload))
+        except (ValueError, KeyError, zlib.error):
+            self.send_error(400)
+            return
+
+        self.server.bytes_in += len(body)
+        self.server.bytes_out += len(response)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Encoding', 'deflate')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+def run_server(host='127.0.0.1', port=8765, filename='sync_server.json'):
+    server = SyncServer((host, port), filename)
+    print(f'Sync server listening on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f'Received {server.bytes_in} bytes, sent {server.bytes_out} bytes')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Expense Tracker reference sync server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--data', default='sync_server.json')
+    args = parser.parse_args()
+    run_server(args.host, args.port, args.data)
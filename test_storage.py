@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from main import SecureStorage
+from sync import SyncServer, resolve
+
+
+def expense(amount, description, day='2026-10-01'):
+    return {'amount': amount, 'category': 'Food', 'payment_method': 'Cash', 'description': description,
+            'recurring': 'No', 'date': f'{day} 10:00:00'}
+
+
+def descriptions(storage, collection='expenses'):
+    return sorted(r['description'] for r in storage.records(storage.load_data(), collection))
+
+
+# Every test runs in its own directory, since the storage files live next to the working directory
+class StorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+
+# Two processes committing to the same data file
+class RebaseTest(StorageTestCase):
+    def test_concurrent_saves_keep_both_edits(self):
+        first, second = SecureStorage('data.json'), SecureStorage('data.json')
+        a, b = first.load_data(), second.load_data()
+        first.add_record(a, 'expenses', expense(100, 'lunch'))
+        first.set_budget(a, 'Food', 500)
+        first.save_data(a)
+
+        # The second process still holds the old revision, so its save replays onto the first commit
+        second.add_record(b, 'expenses', expense(40, 'bus'))
+        second.set_budget(b, 'Transport', 200)
+        second.save_data(b)
+
+        third = SecureStorage('data.json')
+        self.assertEqual(descriptions(third), ['bus', 'lunch'])
+        self.assertEqual(third.load_data()['budgets'], {'Food': 500, 'Transport': 200})
+        self.assertEqual(len({r['id'] for r in third.records(third.load_data(), 'expenses')}), 2)
+        self.assertEqual(third.load_data()['spending']['2026-10']['Food'], {'INR': 140})
+
+    def test_edit_and_delete_from_both_sides(self):
+        first = SecureStorage('data.json')
+        data = first.load_data()
+        kept = first.add_record(data, 'expenses', expense(100, 'lunch'))
+        dropped = first.add_record(data, 'expenses', expense(30, 'snack'))
+        first.save_data(data)
+
+        second = SecureStorage('data.json')
+        b = second.load_data()
+        record = second.find_record(b, 'expenses', dropped['uid'], dropped['date'])
+        second.update_record(b, 'expenses', record, lambda r: r.update(deleted=True))
+        first.update_record(data, 'expenses', kept, lambda r: r.update(amount=120))
+        first.save_data(data)
+        second.save_data(b)
+
+        # Each process catches up on the other's commit, as poll() would
+        for storage in (first, second, SecureStorage('data.json')):
+            with storage.transaction(save=False) as data:
+                pass
+            self.assertEqual([(r['description'], r['amount']) for r in storage.records(data, 'expenses')],
+                             [('lunch', 120)])
+
+
+# Two devices exchanging changes through the reference server
+class SyncTest(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = SyncServer(('127.0.0.1', 0))
+        self.server.RequestHandlerClass.log_message = lambda *args: None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.devices = [SecureStorage('phone.json'), SecureStorage('laptop.json')]
+
+    def tearDown(self):
+        for device in self.devices:
+            if device.sync_client is not None:
+                device.sync_client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def test_round_trip_converges(self):
+        phone, laptop = self.devices
+        data = phone.load_data()
+        for i in range(250):
+            phone.add_record(data, 'expenses', expense(i, f'e{i}'))
+        phone.set_budget(data, 'Food', 500)
+        phone.save_data(data)
+
+        self.assertEqual(phone.sync(self.url)['pushed'], 251)
+        self.assertEqual(laptop.sync(self.url)['pulled'], 251)
+        self.assertEqual(descriptions(laptop), descriptions(phone))
+        self.assertEqual(laptop.load_data()['budgets'], {'Food': 500})
+        self.assertEqual(laptop.load_data()['spending'], phone.load_data()['spending'])
+
+        # A delete on one device removes the record on the other
+        data = laptop.load_data()
+        record = next(r for r in laptop.records(data, 'expenses') if r['description'] == 'e0')
+        laptop.update_record(data, 'expenses', record, lambda r: r.update(deleted=True))
+        laptop.save_data(data)
+        laptop.sync(self.url)
+        phone.sync(self.url)
+        self.assertNotIn('e0', descriptions(phone))
+        self.assertEqual(phone.sync(self.url)['pulled'], 0)
+
+    def test_conflicting_edits_pick_the_same_winner(self):
+        phone, laptop = self.devices
+        data = phone.load_data()
+        record = phone.add_record(data, 'expenses', expense(100, 'lunch'))
+        phone.save_data(data)
+        phone.sync(self.url)
+        laptop.sync(self.url)
+
+        for device, amount, budget in ((phone, 110, 600), (laptop, 120, 700)):
+            data = device.load_data()
+            mine = device.find_record(data, 'expenses', record['uid'], record['date'])
+            device.update_record(data, 'expenses', mine, lambda r: r.update(amount=amount))
+            device.set_budget(data, 'Food', budget)
+            device.save_data(data)
+        phone.sync(self.url)
+        laptop.sync(self.url)
+        phone.sync(self.url)
+
+        results = []
+        for device in self.devices:
+            data = device.load_data()
+            results.append(([r['amount'] for r in device.records(data, 'expenses')], data['budgets']))
+        self.assertEqual(results[0], results[1])
+        self.assertIn(results[0][0], ([110], [120]))
+
+    def test_resolve_is_order_independent(self):
+        a = {'collection': 'expenses', 'uid': 'x', 'vv': {'phone': 2}, 'record': {'amount': 110}}
+        b = {'collection': 'expenses', 'uid': 'x', 'vv': {'laptop': 2}, 'record': {'amount': 120}}
+        self.assertEqual(resolve(a, b), resolve(b, a))
+        self.assertEqual(resolve(a, b)['vv'], {'phone': 2, 'laptop': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()